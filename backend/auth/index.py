@@ -5,6 +5,7 @@ import hashlib
 import random
 import string
 from datetime import datetime, timedelta
+from serialization import json_response
 
 def handler(event: dict, context) -> dict:
     """API для регистрации и авторизации пользователей"""
@@ -47,11 +48,7 @@ def handler(event: dict, context) -> dict:
                 # sms_api_key = os.environ.get('SMS_API_KEY')
                 # requests.post(f'https://sms.ru/sms/send?api_id={sms_api_key}&to={phone}&msg={code}')
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'dev_code': code})
-                }
+                return json_response(200, {'success': True, 'dev_code': code}, event)
             
             elif action == 'verify_code':
                 phone = body.get('phone')
@@ -66,17 +63,9 @@ def handler(event: dict, context) -> dict:
                 if result:
                     cur.execute("UPDATE sms_codes SET is_used = TRUE WHERE id = %s", (result[0],))
                     conn.commit()
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True, 'verified': True})
-                    }
+                    return json_response(200, {'success': True, 'verified': True}, event)
                 else:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'Invalid code'})
-                    }
+                    return json_response(400, {'success': False, 'error': 'Invalid code'}, event)
             
             elif action == 'register':
                 phone = body.get('phone')
@@ -93,7 +82,7 @@ def handler(event: dict, context) -> dict:
                 
                 # Создаем чат "Сохраненные сообщения"
                 cur.execute(
-                    "INSERT INTO chats (type, name, created_by) VALUES ('saved', 'Сохраненные сообщения', %s) RETURNING id",
+                    "INSERT INTO chats (type, name, created_by, member_count) VALUES ('saved', 'Сохраненные сообщения', %s, 1) RETURNING id",
                     (user_id,)
                 )
                 saved_chat_id = cur.fetchone()[0]
@@ -111,26 +100,22 @@ def handler(event: dict, context) -> dict:
                 )
                 user = cur.fetchone()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'user': {
-                            'id': user[0],
-                            'username': user[1],
-                            'display_name': user[2],
-                            'avatar_url': user[3],
-                            'banner_url': user[4],
-                            'bio': user[5],
-                            'status': user[6],
-                            'status_emoji': user[7],
-                            'has_verification': user[8],
-                            'balance': float(user[9]) if user[9] else 0,
-                            'raccoon_coins': user[10]
-                        }
-                    })
-                }
+                return json_response(200, {
+                    'success': True,
+                    'user': {
+                        'id': user[0],
+                        'username': user[1],
+                        'display_name': user[2],
+                        'avatar_url': user[3],
+                        'banner_url': user[4],
+                        'bio': user[5],
+                        'status': user[6],
+                        'status_emoji': user[7],
+                        'has_verification': user[8],
+                        'balance': float(user[9]) if user[9] else 0,
+                        'raccoon_coins': user[10]
+                    }
+                }, event)
             
             elif action == 'login':
                 phone = body.get('phone')
@@ -147,38 +132,26 @@ def handler(event: dict, context) -> dict:
                     cur.execute("UPDATE users SET is_online = TRUE, last_seen = NOW() WHERE id = %s", (user[0],))
                     conn.commit()
                     
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({
-                            'success': True,
-                            'user': {
-                                'id': user[0],
-                                'username': user[1],
-                                'display_name': user[2],
-                                'avatar_url': user[3],
-                                'banner_url': user[4],
-                                'bio': user[5],
-                                'status': user[6],
-                                'status_emoji': user[7],
-                                'has_verification': user[8],
-                                'balance': float(user[9]) if user[9] else 0,
-                                'raccoon_coins': user[10]
-                            }
-                        })
-                    }
+                    return json_response(200, {
+                        'success': True,
+                        'user': {
+                            'id': user[0],
+                            'username': user[1],
+                            'display_name': user[2],
+                            'avatar_url': user[3],
+                            'banner_url': user[4],
+                            'bio': user[5],
+                            'status': user[6],
+                            'status_emoji': user[7],
+                            'has_verification': user[8],
+                            'balance': float(user[9]) if user[9] else 0,
+                            'raccoon_coins': user[10]
+                        }
+                    }, event)
                 else:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'Invalid credentials'})
-                    }
+                    return json_response(401, {'success': False, 'error': 'Invalid credentials'}, event)
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return json_response(405, {'error': 'Method not allowed'}, event)
     
     finally:
         cur.close()
@@ -0,0 +1,201 @@
+import json
+import os
+import psycopg2
+from serialization import json_response
+
+MAX_BATCH_SIZE = 20
+# Функции не делят код между собой, поэтому запросы ниже — копии из соседних функций.
+# При правке исходника править и копию: NOT_PURGED и list_chats — backend/chats, get_profile — backend/profile,
+# get_balance и get_gifts — backend/shop, get_friends — backend/profile
+# Сообщения под заданием очистки скрыты от чтения до физического удаления, в том числе если задание сорвалось
+NOT_PURGED = """NOT EXISTS (
+    SELECT 1 FROM purge_jobs pj
+    WHERE pj.status IN ('pending', 'running', 'failed') AND pj.user_id = m.sender_id
+      AND (pj.chat_id = m.chat_id OR pj.chat_id IS NULL) AND m.created_at <= pj.cutoff_at
+)"""
+
+def get_profile(cur, user_id, params):
+    cur.execute("""
+        SELECT id, username, display_name, avatar_url, banner_url, bio, status, status_emoji,
+               is_online, ghost_mode, has_verification, balance, raccoon_coins, created_at, last_seen
+        FROM users WHERE id = %s
+    """, (params.get('user_id', user_id),))
+    
+    user = cur.fetchone()
+    if not user:
+        return 404, {'error': 'User not found'}
+    
+    return 200, {
+        'id': user[0],
+        'username': user[1],
+        'display_name': user[2],
+        'avatar_url': user[3],
+        'banner_url': user[4],
+        'bio': user[5],
+        'status': user[6],
+        'status_emoji': user[7],
+        'is_online': user[8] and not user[9],
+        'has_verification': user[10],
+        'balance': float(user[11]) if user[11] else 0,
+        'raccoon_coins': user[12],
+        'created_at': user[13].isoformat() if user[13] else None,
+        'last_seen': user[14].isoformat() if user[14] else None
+    }
+
+def list_chats(cur, user_id, params):
+    # Вторая ветка последнего сообщения выполняется, только если последнее по last_message_at скрыто очисткой
+    cur.execute(f"""
+        SELECT c.id, c.type, c.name, c.avatar_url, c.created_at,
+               (SELECT content FROM (
+                   (SELECT m.content FROM messages m WHERE m.chat_id = c.id AND m.created_at >= c.last_message_at AND {NOT_PURGED} ORDER BY m.created_at DESC, m.id DESC LIMIT 1)
+                   UNION ALL
+                   (SELECT m.content FROM messages m WHERE m.chat_id = c.id AND m.created_at < c.last_message_at AND {NOT_PURGED} ORDER BY m.created_at DESC, m.id DESC LIMIT 1)
+               ) latest LIMIT 1) as last_message,
+               (SELECT COUNT(*) FROM messages m WHERE m.chat_id = c.id AND m.is_read = FALSE AND m.sender_id != %s AND {NOT_PURGED}) as unread_count
+        FROM chats c
+        JOIN chat_members cm ON c.id = cm.chat_id
+        WHERE cm.user_id = %s AND cm.is_blocked = FALSE
+        ORDER BY c.created_at DESC
+    """, (user_id, user_id))
+    
+    chats = []
+    for row in cur.fetchall():
+        chats.append({
+            'id': row[0],
+            'type': row[1],
+            'name': row[2],
+            'avatar_url': row[3],
+            'created_at': row[4].isoformat() if row[4] else None,
+            'last_message': row[5],
+            'unread_count': row[6]
+        })
+    
+    return 200, {'chats': chats}
+
+def get_balance(cur, user_id, params):
+    cur.execute("SELECT balance, raccoon_coins FROM users WHERE id = %s", (user_id,))
+    result = cur.fetchone()
+    
+    if not result:
+        return 404, {'error': 'User not found'}
+    
+    return 200, {
+        'balance': float(result[0]) if result[0] else 0,
+        'raccoon_coins': result[1]
+    }
+
+def get_gifts(cur, user_id, params):
+    cur.execute("""
+        SELECT id, name, emoji, price, category
+        FROM shop_gifts
+        WHERE is_active = TRUE
+        ORDER BY category, price
+    """)
+    
+    gifts = []
+    for row in cur.fetchall():
+        gifts.append({
+            'id': row[0],
+            'name': row[1],
+            'emoji': row[2],
+            'price': row[3],
+            'category': row[4]
+        })
+    
+    return 200, {'gifts': gifts}
+
+def get_friends(cur, user_id, params):
+    cur.execute("""
+        SELECT u.id, u.username, u.display_name, u.avatar_url, u.is_online, u.ghost_mode, f.status
+        FROM friends f
+        JOIN users u ON (f.friend_id = u.id AND f.user_id = %s) OR (f.user_id = u.id AND f.friend_id = %s)
+        WHERE (f.user_id = %s OR f.friend_id = %s) AND f.status = 'accepted'
+    """, (user_id, user_id, user_id, user_id))
+    
+    friends = []
+    for row in cur.fetchall():
+        friends.append({
+            'id': row[0],
+            'username': row[1],
+            'display_name': row[2],
+            'avatar_url': row[3],
+            'is_online': row[4] and not row[5]
+        })
+    
+    return 200, {'friends': friends}
+
+# Только читающие действия: их безопасно выполнять подряд в одной read-only транзакции
+ACTIONS = {
+    'get_profile': get_profile,
+    'list_chats': list_chats,
+    'get_balance': get_balance,
+    'get_gifts': get_gifts,
+    'get_friends': get_friends
+}
+
+def handler(event: dict, context) -> dict:
+    """API для пакетного выполнения нескольких действий за один запрос"""
+    
+    method = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
+            },
+            'body': ''
+        }
+    
+    if method != 'POST':
+        return json_response(405, {'error': 'Method not allowed'}, event)
+    
+    body = json.loads(event.get('body', '{}'))
+    requests = body.get('requests', [])
+    
+    if not isinstance(requests, list) or not requests or len(requests) > MAX_BATCH_SIZE:
+        return json_response(400, {'error': f'Expected 1 to {MAX_BATCH_SIZE} requests'}, event)
+    
+    db_url = os.environ['DATABASE_URL']
+    conn = psycopg2.connect(db_url)
+    # Все действия читают один снимок данных через одно соединение
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cur = conn.cursor()
+    
+    try:
+        user_id = event.get('headers', {}).get('X-User-Id') or event.get('headers', {}).get('x-user-id')
+        
+        results = []
+        for i, item in enumerate(requests):
+            if not isinstance(item, dict) or not isinstance(item.get('params') or {}, dict):
+                results.append({'id': i, 'action': None, 'status': 400, 'body': {'error': 'Invalid request'}})
+                continue
+            
+            request_id = item.get('id', i)
+            action = item.get('action')
+            action_handler = ACTIONS.get(action) if isinstance(action, str) else None
+            
+            if not action_handler:
+                results.append({'id': request_id, 'action': action, 'status': 400, 'body': {'error': 'Unknown action'}})
+                continue
+            
+            # Ошибка одного действия не должна прерывать остальные
+            cur.execute("SAVEPOINT batch_item")
+            try:
+                status, result = action_handler(cur, user_id, item.get('params') or {})
+                cur.execute("RELEASE SAVEPOINT batch_item")
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT batch_item")
+                status, result = 500, {'error': str(e).strip()}
+            
+            results.append({'id': request_id, 'action': action, 'status': status, 'body': result})
+        
+        conn.commit()
+        
+        return json_response(200, {'results': results}, event)
+    
+    finally:
+        cur.close()
+        conn.close()
@@ -0,0 +1,273 @@
+import json
+import os
+import psycopg2
+from serialization import json_response
+
+RING_TIMEOUT_SECONDS = 45
+HEARTBEAT_TIMEOUT_SECONDS = 60
+CALL_LOCK_NAMESPACE = 37
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+CALL_TYPES = ('voice', 'video')
+CALL_COLUMNS = 'id, caller_id, receiver_id, call_type, status, started_at, answered_at, ended_at, duration'
+
+def expire_stale_calls(cur, user_ids):
+    """Неотвеченные за RING_TIMEOUT_SECONDS звонки становятся пропущенными, а идущие без heartbeat
+    дольше HEARTBEAT_TIMEOUT_SECONDS завершаются на момент последнего сигнала: упавший клиент не держит "занято" вечно"""
+    cur.execute("""
+        UPDATE calls
+        SET status = CASE WHEN status = 'ringing' THEN 'missed' ELSE 'ended' END,
+            ended_at = CASE WHEN status = 'ringing' THEN CURRENT_TIMESTAMP ELSE COALESCE(heartbeat_at, answered_at) END,
+            duration = CASE WHEN status = 'active'
+                THEN EXTRACT(EPOCH FROM COALESCE(heartbeat_at, answered_at) - answered_at)::int ELSE 0 END
+        WHERE (receiver_id = ANY(%s::int[]) OR caller_id = ANY(%s::int[]))
+          AND (
+              (status = 'ringing' AND started_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+              OR (status = 'active' AND COALESCE(heartbeat_at, answered_at) < CURRENT_TIMESTAMP - make_interval(secs => %s))
+          )
+    """, (user_ids, user_ids, RING_TIMEOUT_SECONDS, HEARTBEAT_TIMEOUT_SECONDS))
+
+def call_to_dict(row):
+    return {
+        'id': row[0],
+        'caller_id': row[1],
+        'receiver_id': row[2],
+        'call_type': row[3],
+        'status': row[4],
+        'started_at': row[5].isoformat() if row[5] else None,
+        'answered_at': row[6].isoformat() if row[6] else None,
+        'ended_at': row[7].isoformat() if row[7] else None,
+        'duration': row[8]
+    }
+
+def handler(event: dict, context) -> dict:
+    """API для звонков: сигнализация и история"""
+    
+    method = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
+            },
+            'body': ''
+        }
+    
+    db_url = os.environ['DATABASE_URL']
+    conn = psycopg2.connect(db_url)
+    cur = conn.cursor()
+    
+    try:
+        user_id = event.get('headers', {}).get('X-User-Id') or event.get('headers', {}).get('x-user-id')
+        
+        if method == 'GET':
+            params = event.get('queryStringParameters', {}) or {}
+            action = params.get('action')
+            
+            # Эти чтения сначала завершают просроченные звонки пользователя, им нужен числовой id
+            if action in ('incoming_call', 'call_state', 'missed_count') and not str(user_id).isdigit():
+                return json_response(400, {'error': 'X-User-Id is required'}, event)
+            
+            if action == 'incoming_call':
+                expire_stale_calls(cur, [int(user_id)])
+                conn.commit()
+                
+                # Опрос входящего звонка читает только частичный индекс idx_calls_receiver_live
+                cur.execute("""
+                    SELECT c.id, c.caller_id, c.receiver_id, c.call_type, c.status, c.started_at, c.answered_at, c.ended_at, c.duration,
+                           u.username, u.display_name, u.avatar_url
+                    FROM calls c
+                    JOIN users u ON u.id = c.caller_id
+                    WHERE c.receiver_id = %s AND c.status = 'ringing'
+                    ORDER BY c.started_at DESC
+                    LIMIT 1
+                """, (user_id,))
+                row = cur.fetchone()
+                
+                call = None
+                if row:
+                    call = call_to_dict(row)
+                    call.update({'caller_username': row[9], 'caller_name': row[10], 'caller_avatar': row[11]})
+                
+                return json_response(200, {'call': call}, event)
+            
+            elif action == 'call_state':
+                call_id = params.get('call_id')
+                
+                # Без этого звонок, который никто не закрыл, так и висел бы ringing или active
+                expire_stale_calls(cur, [int(user_id)])
+                conn.commit()
+                
+                cur.execute(
+                    f"SELECT {CALL_COLUMNS} FROM calls WHERE id = %s AND (caller_id = %s OR receiver_id = %s)",
+                    (call_id, user_id, user_id)
+                )
+                row = cur.fetchone()
+                
+                if not row:
+                    return json_response(404, {'error': 'Call not found'}, event)
+                
+                return json_response(200, call_to_dict(row), event)
+            
+            elif action == 'call_history':
+                limit = min(int(params.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+                cursor = params.get('cursor')
+                
+                keyset = ''
+                keyset_values = ()
+                if cursor:
+                    cursor_started_at, _, cursor_id = cursor.rpartition('_')
+                    keyset = 'AND (started_at, id) < (%s, %s)'
+                    keyset_values = (cursor_started_at, int(cursor_id))
+                
+                cur.execute(f"""
+                    SELECT c.id, c.caller_id, c.receiver_id, c.call_type, c.status, c.started_at, c.answered_at, c.ended_at, c.duration,
+                           u.username, u.display_name, u.avatar_url
+                    FROM (
+                        (SELECT {CALL_COLUMNS} FROM calls WHERE caller_id = %s {keyset} ORDER BY started_at DESC, id DESC LIMIT %s)
+                        UNION
+                        (SELECT {CALL_COLUMNS} FROM calls WHERE receiver_id = %s {keyset} ORDER BY started_at DESC, id DESC LIMIT %s)
+                    ) c
+                    LEFT JOIN users u ON u.id = CASE WHEN c.caller_id = %s THEN c.receiver_id ELSE c.caller_id END
+                    ORDER BY c.started_at DESC, c.id DESC
+                    LIMIT %s
+                """, (user_id,) + keyset_values + (limit + 1, user_id) + keyset_values + (limit + 1, user_id, limit + 1))
+                rows = cur.fetchall()
+                
+                calls = []
+                for row in rows[:limit]:
+                    call = call_to_dict(row)
+                    call.update({
+                        'direction': 'outgoing' if str(row[1]) == str(user_id) else 'incoming',
+                        'peer_username': row[9],
+                        'peer_name': row[10],
+                        'peer_avatar': row[11]
+                    })
+                    calls.append(call)
+                
+                next_cursor = None
+                if len(rows) > limit:
+                    next_cursor = f"{rows[limit - 1][5].isoformat()}_{rows[limit - 1][0]}"
+                
+                return json_response(200, {'calls': calls, 'next_cursor': next_cursor}, event)
+            
+            elif action == 'missed_count':
+                # Непринятые вовремя звонки становятся missed до подсчета
+                expire_stale_calls(cur, [int(user_id)])
+                conn.commit()
+                
+                # Считается по частичному индексу idx_calls_missed_unseen, без просмотра истории
+                cur.execute(
+                    "SELECT COUNT(*) FROM calls WHERE receiver_id = %s AND status = 'missed' AND missed_seen = FALSE",
+                    (user_id,)
+                )
+                
+                return json_response(200, {'missed_count': cur.fetchone()[0]}, event)
+        
+        elif method == 'POST':
+            body = json.loads(event.get('body', '{}'))
+            action = body.get('action')
+            
+            if action == 'start_call':
+                receiver_id = body.get('receiver_id')
+                call_type = body.get('call_type', 'voice')
+                
+                if call_type not in CALL_TYPES or not str(receiver_id).isdigit() or not str(user_id).isdigit() or str(receiver_id) == str(user_id):
+                    return json_response(400, {'success': False, 'error': 'Invalid call'}, event)
+                
+                # Под READ COMMITTED проверка NOT EXISTS сама по себе не спасает от двух одновременных звонков:
+                # блокировки на обоих участников (всегда в одном порядке) выстраивают такие запросы в очередь
+                participants = sorted({int(user_id), int(receiver_id)})
+                for participant_id in participants:
+                    cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (CALL_LOCK_NAMESPACE, participant_id))
+                
+                expire_stale_calls(cur, participants)
+                # Звонок создается, только если ни у кого из участников нет идущего звонка
+                cur.execute("""
+                    INSERT INTO calls (caller_id, receiver_id, call_type, status)
+                    SELECT %s, %s, %s, 'ringing'
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM calls
+                        WHERE status IN ('ringing', 'active')
+                          AND (caller_id IN (%s, %s) OR receiver_id IN (%s, %s))
+                    )
+                    RETURNING id, started_at
+                """, (user_id, receiver_id, call_type, user_id, receiver_id, user_id, receiver_id))
+                result = cur.fetchone()
+                conn.commit()
+                
+                if not result:
+                    return json_response(409, {'success': False, 'error': 'Busy'}, event)
+                
+                return json_response(200, {'success': True, 'call_id': result[0], 'started_at': result[1].isoformat()}, event)
+            
+            elif action in ('accept_call', 'decline_call', 'end_call'):
+                call_id = body.get('call_id')
+                
+                # Переходы состояния через compare-and-set: обновление проходит только из ожидаемого статуса
+                if action == 'accept_call':
+                    cur.execute(f"""
+                        UPDATE calls SET status = 'active', answered_at = CURRENT_TIMESTAMP
+                        WHERE id = %s AND receiver_id = %s AND status = 'ringing'
+                          AND started_at >= CURRENT_TIMESTAMP - make_interval(secs => %s)
+                        RETURNING {CALL_COLUMNS}
+                    """, (call_id, user_id, RING_TIMEOUT_SECONDS))
+                elif action == 'decline_call':
+                    cur.execute(f"""
+                        UPDATE calls SET status = 'declined', ended_at = CURRENT_TIMESTAMP, duration = 0
+                        WHERE id = %s AND receiver_id = %s AND status = 'ringing'
+                        RETURNING {CALL_COLUMNS}
+                    """, (call_id, user_id))
+                else:
+                    # Отмена звонящим до ответа делает звонок пропущенным для получателя
+                    cur.execute(f"""
+                        UPDATE calls
+                        SET status = CASE WHEN status = 'ringing' THEN 'missed' ELSE 'ended' END,
+                            ended_at = CURRENT_TIMESTAMP,
+                            duration = CASE WHEN status = 'active'
+                                THEN EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - answered_at)::int ELSE 0 END
+                        WHERE id = %s AND (caller_id = %s OR receiver_id = %s) AND status IN ('ringing', 'active')
+                        RETURNING {CALL_COLUMNS}
+                    """, (call_id, user_id, user_id))
+                row = cur.fetchone()
+                conn.commit()
+                
+                if not row:
+                    return json_response(409, {'success': False, 'error': 'Call is not in a valid state'}, event)
+                
+                return json_response(200, {'success': True, 'call': call_to_dict(row)}, event)
+            
+            elif action == 'heartbeat':
+                call_id = body.get('call_id')
+                
+                # Клиенты шлют сигнал во время разговора; звонок без сигнала завершит expire_stale_calls
+                cur.execute(f"""
+                    UPDATE calls SET heartbeat_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND (caller_id = %s OR receiver_id = %s) AND status = 'active'
+                    RETURNING {CALL_COLUMNS}
+                """, (call_id, user_id, user_id))
+                row = cur.fetchone()
+                conn.commit()
+                
+                if not row:
+                    return json_response(409, {'success': False, 'error': 'Call is not active'}, event)
+                
+                return json_response(200, {'success': True, 'call': call_to_dict(row)}, event)
+            
+            elif action == 'mark_missed_seen':
+                cur.execute(
+                    "UPDATE calls SET missed_seen = TRUE WHERE receiver_id = %s AND status = 'missed' AND missed_seen = FALSE",
+                    (user_id,)
+                )
+                conn.commit()
+                
+                return json_response(200, {'success': True}, event)
+        
+        return json_response(405, {'error': 'Method not allowed'}, event)
+    
+    finally:
+        cur.close()
+        conn.close()
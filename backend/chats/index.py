@@ -4,7 +4,584 @@ import psycopg2
 import boto3
 import base64
 import uuid
-from datetime import datetime
+import re
+import gzip
+import tempfile
+import argparse
+import time
+import random
+from datetime import datetime, date, timedelta
+from serialization import json_response, columnar
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+MESSAGES_PAGE_SIZE = 100
+MESSAGES_MAX_PAGE_SIZE = 500
+MESSAGE_COLUMNS = 'id, chat_id, sender_id, reply_to, content, message_type, file_url, duration, is_read, is_edited, created_at'
+PARTITION_NAME_RE = re.compile(r'^messages_(\d{4})_(\d{2})$')
+ARCHIVE_BUCKET = 'files'
+ARCHIVE_PREFIX = 'archive/messages'
+PURGE_BATCH_SIZE = 1000
+PURGE_PAUSE_SECONDS = 0.05
+PURGE_MAX_SECONDS = 50
+PURGE_MAX_ATTEMPTS = 5
+PURGE_RETRY_SECONDS = 60
+UPLOADS_PREFIX = 'uploads'
+MEMBERS_PAGE_SIZE = 100
+MEMBERS_MAX_PAGE_SIZE = 1000
+MAX_BULK_MEMBERS = 100000
+# Самостоятельно вступить можно только в канал; группы пополняются через add_members
+JOINABLE_CHAT_TYPES = ('channel',)
+REACTION_FLUSH_BATCH = 5000
+REACTION_FLUSH_PROBABILITY = 0.02
+MEMBERSHIP_TTL_SECONDS = 30
+MEMBERSHIP_DENY_TTL_SECONDS = 5
+MEMBERSHIP_CACHE_SIZE = 50000
+# Сообщения под заданием очистки скрыты от чтения до физического удаления, в том числе если задание сорвалось
+# Копия живет в backend/batch вместе с запросом list_chats: менять вместе
+NOT_PURGED = """NOT EXISTS (
+    SELECT 1 FROM purge_jobs pj
+    WHERE pj.status IN ('pending', 'running', 'failed') AND pj.user_id = m.sender_id
+      AND (pj.chat_id = m.chat_id OR pj.chat_id IS NULL) AND m.created_at <= pj.cutoff_at
+)"""
+
+# Роли участников в теплом экземпляре функции: (chat_id, user_id) -> (role, expires_at)
+_membership_cache = {}
+
+def get_s3_client():
+    return boto3.client('s3',
+        endpoint_url='https://bucket.poehali.dev',
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+    )
+
+def fetch_messages_page(cur, chat_id, limit, cursor=None):
+    """Страница сообщений чата от новых к старым; граница по created_at отсекает лишние секции"""
+    keyset = ''
+    values = (chat_id,)
+    if cursor:
+        cursor_created_at, _, cursor_id = cursor.rpartition('_')
+        keyset = 'AND m.created_at <= %s AND (m.created_at, m.id) < (%s, %s)'
+        values += (cursor_created_at, cursor_created_at, int(cursor_id))
+    
+    cur.execute(f"""
+        SELECT m.id, m.sender_id, u.username, u.display_name, u.avatar_url,
+               m.content, m.message_type, m.file_url, m.duration, m.reply_to, m.is_read, m.is_edited, m.created_at
+        FROM (
+            SELECT * FROM messages m
+            WHERE m.chat_id = %s AND {NOT_PURGED} {keyset}
+            ORDER BY m.created_at DESC, m.id DESC
+            LIMIT %s
+        ) m
+        JOIN users u ON m.sender_id = u.id
+        ORDER BY m.created_at DESC, m.id DESC
+    """, values + (limit + 1,))
+    return cur.fetchall()
+
+def partition_range(partition_name):
+    match = PARTITION_NAME_RE.match(partition_name)
+    if not match:
+        raise ValueError(f'Invalid messages partition: {partition_name}')
+    start = date(int(match.group(1)), int(match.group(2)), 1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+def create_partition(cur, month_start):
+    name = f'messages_{month_start:%Y_%m}'
+    start, end = partition_range(name)
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages FOR VALUES FROM ('{start}') TO ('{end}')")
+    return name
+
+def archive_location(partition_name):
+    archive_dir = os.environ.get('MESSAGES_ARCHIVE_DIR')
+    if archive_dir:
+        return os.path.join(archive_dir, f'{partition_name}.csv.gz')
+    return f's3://{ARCHIVE_BUCKET}/{ARCHIVE_PREFIX}/{partition_name}.csv.gz'
+
+def archive_partition(conn, s3, partition_name) -> dict:
+    """Отсоединяет месячную секцию, выгружает ее в сжатый CSV в холодном хранилище и удаляет"""
+    start, end = partition_range(partition_name)
+    location = archive_location(partition_name)
+    cur = conn.cursor()
+    
+    try:
+        # Секция уходит из messages короткой транзакцией до выгрузки, и чтение с записью не ждут загрузки в хранилище.
+        # DETACH CONCURRENTLY недоступен при секции по умолчанию, поэтому обычный DETACH ограничен lock_timeout.
+        # Статус archiving отмечает уже отсоединенную таблицу: повторный запуск доводит выгрузку после сбоя
+        cur.execute("SELECT status FROM message_archives WHERE partition_name = %s FOR UPDATE", (partition_name,))
+        current = cur.fetchone()
+        if not current or current[0] != 'archiving':
+            cur.execute("SET LOCAL lock_timeout = '5s'")
+            cur.execute(f"ALTER TABLE messages DETACH PARTITION {partition_name}")
+            cur.execute("""
+                INSERT INTO message_archives (partition_name, range_start, range_end, location, status)
+                VALUES (%s, %s, %s, %s, 'archiving')
+                ON CONFLICT (partition_name) DO UPDATE
+                SET location = EXCLUDED.location, status = 'archiving', restored_at = NULL
+            """, (partition_name, start, end, location))
+        conn.commit()
+        
+        # Отсоединенная таблица не получает записей, блокировка для согласованного архива не нужна
+        cur.execute(f"SELECT COALESCE(array_agg(DISTINCT chat_id), '{{}}'), COUNT(*) FROM {partition_name}")
+        chat_ids, row_count = cur.fetchone()
+        
+        with tempfile.NamedTemporaryFile(suffix='.csv.gz') as tmp:
+            with gzip.open(tmp.name, 'wb') as archive:
+                cur.copy_expert(f"COPY (SELECT {MESSAGE_COLUMNS} FROM {partition_name}) TO STDOUT WITH (FORMAT csv)", archive)
+            conn.commit()
+            
+            if location.startswith('s3://'):
+                s3.upload_file(tmp.name, ARCHIVE_BUCKET, location[len(f's3://{ARCHIVE_BUCKET}/'):])
+            else:
+                os.makedirs(os.path.dirname(location), exist_ok=True)
+                with open(tmp.name, 'rb') as src, open(location, 'wb') as dst:
+                    dst.write(src.read())
+        
+        cur.execute("""
+            UPDATE message_archives
+            SET chat_ids = %s, row_count = %s, status = 'archived', archived_at = CURRENT_TIMESTAMP
+            WHERE partition_name = %s
+        """, (chat_ids, row_count, partition_name))
+        cur.execute(f"DROP TABLE {partition_name}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    
+    return {'partition': partition_name, 'location': location, 'rows': row_count}
+
+def restore_partition(conn, s3, partition_name) -> bool:
+    """Возвращает секцию из холодного хранилища: данные грузятся в отдельную таблицу, к messages она только присоединяется"""
+    cur = conn.cursor()
+    
+    try:
+        cur.execute(
+            "SELECT location FROM message_archives WHERE partition_name = %s AND status IN ('archived', 'restoring') FOR UPDATE",
+            (partition_name,)
+        )
+        archived = cur.fetchone()
+        if not archived:
+            conn.rollback()
+            return False
+        
+        location = archived[0]
+        start, end = partition_range(partition_name)
+        
+        with tempfile.NamedTemporaryFile(suffix='.csv.gz') as tmp:
+            if location.startswith('s3://'):
+                s3.download_file(ARCHIVE_BUCKET, location[len(f's3://{ARCHIVE_BUCKET}/'):], tmp.name)
+                source = tmp.name
+            else:
+                source = location
+            
+            # Загрузка в отдельную таблицу не берет блокировок на messages
+            cur.execute(f"CREATE TABLE {partition_name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)")
+            with gzip.open(source, 'rb') as archive:
+                cur.copy_expert(f"COPY {partition_name} ({MESSAGE_COLUMNS}) FROM STDIN WITH (FORMAT csv)", archive)
+        
+        # Воркер очистки не видит отсоединенных секций и мог завершить задание, не тронув архив,
+        # поэтому строки под заданиями в любом статусе удаляются до присоединения вместе с реакциями и файлами
+        cur.execute(f"""
+            WITH purged AS (
+                DELETE FROM {partition_name} m
+                WHERE EXISTS (
+                    SELECT 1 FROM purge_jobs pj
+                    WHERE pj.user_id = m.sender_id AND (pj.chat_id = m.chat_id OR pj.chat_id IS NULL)
+                      AND m.created_at <= pj.cutoff_at
+                )
+                RETURNING m.id, m.sender_id, m.file_url
+            ), reactions AS (
+                DELETE FROM message_reactions WHERE message_id IN (SELECT id FROM purged)
+            ), reaction_counts AS (
+                DELETE FROM message_reaction_counts WHERE message_id IN (SELECT id FROM purged)
+            ), reaction_deltas AS (
+                DELETE FROM reaction_count_deltas WHERE message_id IN (SELECT id FROM purged)
+            )
+            SELECT sender_id, file_url FROM purged WHERE file_url IS NOT NULL
+        """)
+        purged_files = cur.fetchall()
+        # Без клиента S3 (CLI с локальным каталогом архивов) файлы остаются в хранилище
+        if s3 is not None:
+            keys = [key for key in (owned_upload_key(url, sender_id) for sender_id, url in purged_files) if key]
+            for i in range(0, len(keys), 1000):
+                s3.delete_objects(Bucket='files', Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True})
+        
+        # CHECK по границам секции избавляет ATTACH от проверочного прохода по данным,
+        # а сам ATTACH берет на messages только SHARE UPDATE EXCLUSIVE и не мешает чтению и записи
+        cur.execute(f"""
+            ALTER TABLE {partition_name} ADD CONSTRAINT {partition_name}_bounds
+            CHECK (created_at IS NOT NULL AND created_at >= '{start}' AND created_at < '{end}')
+        """)
+        cur.execute(f"ALTER TABLE messages ATTACH PARTITION {partition_name} FOR VALUES FROM ('{start}') TO ('{end}')")
+        cur.execute(f"ALTER TABLE {partition_name} DROP CONSTRAINT {partition_name}_bounds")
+        cur.execute(
+            "UPDATE message_archives SET status = 'restored', restored_at = CURRENT_TIMESTAMP, restore_requested_at = NULL WHERE partition_name = %s",
+            (partition_name,)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    
+    return True
+
+def request_restore(cur, chat_id, before=None) -> bool:
+    """Ставит в очередь ближайшую архивную секцию с сообщениями чата старше before; True, если такая есть"""
+    cur.execute("""
+        UPDATE message_archives
+        SET status = 'restoring', restore_requested_at = COALESCE(restore_requested_at, CURRENT_TIMESTAMP)
+        WHERE partition_name = (
+            SELECT partition_name FROM message_archives
+            WHERE status IN ('archived', 'restoring') AND chat_ids @> ARRAY[%s]::int[]
+              AND range_start < COALESCE(%s::timestamp, 'infinity')
+            ORDER BY range_start DESC
+            LIMIT 1
+        )
+        RETURNING partition_name
+    """, (int(chat_id), before))
+    return cur.fetchone() is not None
+
+def restore_requested_partitions(conn, s3, max_seconds=PURGE_MAX_SECONDS) -> dict:
+    """Поднимает секции из очереди восстановления; сбойная секция возвращается в архив и не держит очередь"""
+    deadline = time.monotonic() + max_seconds
+    report = {'restored': [], 'failed': []}
+    cur = conn.cursor()
+    
+    try:
+        while time.monotonic() < deadline:
+            cur.execute("""
+                SELECT partition_name FROM message_archives
+                WHERE status = 'restoring'
+                ORDER BY restore_requested_at
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            """)
+            requested = cur.fetchone()
+            if not requested:
+                conn.rollback()
+                break
+            
+            try:
+                if restore_partition(conn, s3, requested[0]):
+                    report['restored'].append(requested[0])
+            except Exception as e:
+                cur.execute(
+                    "UPDATE message_archives SET status = 'archived', restore_requested_at = NULL WHERE partition_name = %s",
+                    (requested[0],)
+                )
+                conn.commit()
+                report['failed'].append({'partition': requested[0], 'error': str(e)})
+    finally:
+        cur.close()
+    
+    return report
+
+def archive_old_partitions(conn, s3, older_than_months) -> list:
+    cutoff = date.today().replace(day=1)
+    for _ in range(older_than_months):
+        cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+    
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+        ORDER BY c.relname
+    """)
+    partitions = [row[0] for row in cur.fetchall() if PARTITION_NAME_RE.match(row[0])]
+    # Секции, отсоединенные прерванной выгрузкой, доводятся до архива в первую очередь
+    cur.execute("SELECT partition_name FROM message_archives WHERE status = 'archiving' ORDER BY partition_name")
+    interrupted = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.rollback()
+    
+    return [archive_partition(conn, s3, name) for name in interrupted + [name for name in partitions if partition_range(name)[1] <= cutoff]]
+
+def create_upcoming_partitions(conn, months_ahead) -> list:
+    month_start = date.today().replace(day=1)
+    cur = conn.cursor()
+    created = []
+    for _ in range(months_ahead + 1):
+        created.append(create_partition(cur, month_start))
+        month_start = (month_start + timedelta(days=32)).replace(day=1)
+    conn.commit()
+    cur.close()
+    return created
+
+def get_member_role(cur, chat_id, user_id):
+    """Роль пользователя в чате или None; запрос читает только индекс idx_chat_members_active_user_chat"""
+    cur.execute(
+        "SELECT role FROM chat_members WHERE user_id = %s AND chat_id = %s AND is_blocked = FALSE",
+        (user_id, chat_id)
+    )
+    result = cur.fetchone()
+    return result[0] if result else None
+
+def get_cached_member_role(cur, chat_id, user_id):
+    """Роль из кэша процесса; отказ живет меньше, чтобы только что вступивший не ждал полный TTL"""
+    # Без chat_id или X-User-Id пользователь просто не участник: 403, а не ошибка сервера
+    if not str(chat_id).isdigit() or not str(user_id).isdigit():
+        return None
+    
+    key = (int(chat_id), int(user_id))
+    now = time.monotonic()
+    cached = _membership_cache.get(key)
+    if cached and cached[1] > now:
+        return cached[0]
+    
+    role = get_member_role(cur, chat_id, user_id)
+    if len(_membership_cache) >= MEMBERSHIP_CACHE_SIZE:
+        _membership_cache.clear()
+    _membership_cache[key] = (role, now + (MEMBERSHIP_TTL_SECONDS if role else MEMBERSHIP_DENY_TTL_SECONDS))
+    return role
+
+def invalidate_membership(chat_id, user_ids):
+    """Сбрасывает кэш этого экземпляра; остальные экземпляры догонят по TTL"""
+    for member_id in user_ids:
+        _membership_cache.pop((int(chat_id), int(member_id)), None)
+
+def add_members(cur, chat_id, user_ids, role='member'):
+    """Добавляет участников одним INSERT ... SELECT unnest и возвращает число новых строк.
+    Несуществующие id пропускаются соединением с users, а не обрывают весь запрос на внешнем ключе"""
+    cur.execute("""
+        WITH added AS (
+            INSERT INTO chat_members (chat_id, user_id, role)
+            SELECT %s, u.id, %s
+            FROM unnest(%s::int[]) u(id)
+            JOIN users ON users.id = u.id
+            ON CONFLICT (chat_id, user_id) DO NOTHING
+            RETURNING 1
+        )
+        UPDATE chats SET member_count = member_count + (SELECT COUNT(*) FROM added)
+        WHERE id = %s
+        RETURNING (SELECT COUNT(*) FROM added)
+    """, (chat_id, role, user_ids, chat_id))
+    result = cur.fetchone()
+    return result[0] if result else 0
+
+def remove_members(cur, chat_id, user_ids, keep_blocked=False):
+    """Удаляет участников (кроме владельца) одним DELETE и возвращает число удаленных.
+    keep_blocked оставляет строки заблокированных: выход и повторный вход не должен снимать блокировку"""
+    cur.execute(f"""
+        WITH removed AS (
+            DELETE FROM chat_members
+            WHERE chat_id = %s AND user_id = ANY(%s::int[]) AND role != 'owner' {'AND is_blocked = FALSE' if keep_blocked else ''}
+            RETURNING is_blocked
+        )
+        UPDATE chats SET member_count = member_count - (SELECT COUNT(*) FROM removed WHERE NOT is_blocked)
+        WHERE id = %s
+        RETURNING (SELECT COUNT(*) FROM removed)
+    """, (chat_id, user_ids, chat_id))
+    result = cur.fetchone()
+    return result[0] if result else 0
+
+def set_members_blocked(cur, chat_id, user_ids, blocked):
+    """Блокирует или разблокирует участников (кроме владельца) и поправляет member_count"""
+    cur.execute("""
+        WITH changed AS (
+            UPDATE chat_members SET is_blocked = %s
+            WHERE chat_id = %s AND user_id = ANY(%s::int[]) AND role != 'owner' AND is_blocked != %s
+            RETURNING 1
+        )
+        UPDATE chats SET member_count = member_count + (CASE WHEN %s THEN -1 ELSE 1 END) * (SELECT COUNT(*) FROM changed)
+        WHERE id = %s
+        RETURNING (SELECT COUNT(*) FROM changed)
+    """, (blocked, chat_id, user_ids, blocked, blocked, chat_id))
+    result = cur.fetchone()
+    return result[0] if result else 0
+
+def parse_user_ids(user_ids):
+    """Уникальные id в исходном порядке; None, если это не список числовых id"""
+    user_ids = user_ids or []
+    if not isinstance(user_ids, list) or not all(str(member_id).isdigit() for member_id in user_ids):
+        return None
+    return list(dict.fromkeys(int(member_id) for member_id in user_ids))
+
+def flush_reaction_counts(conn, batch_size=REACTION_FLUSH_BATCH) -> int:
+    """Сворачивает пачку буферизованных нажатий в message_reaction_counts; всплеск по одному посту дает одно обновление.
+    Счетчики обновляются в порядке (message_id, emoji), чтобы параллельные flush не взаимоблокировались"""
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("""
+            WITH batch AS (
+                DELETE FROM reaction_count_deltas
+                WHERE id IN (
+                    SELECT id FROM reaction_count_deltas
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING message_id, emoji, delta
+            ), applied AS (
+                INSERT INTO message_reaction_counts (message_id, emoji, count)
+                SELECT message_id, emoji, SUM(delta) FROM batch GROUP BY message_id, emoji ORDER BY message_id, emoji
+                ON CONFLICT (message_id, emoji) DO UPDATE
+                SET count = message_reaction_counts.count + EXCLUDED.count
+            )
+            SELECT COUNT(*) FROM batch
+        """, (batch_size,))
+        flushed = cur.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    
+    return flushed
+
+def maybe_flush_reaction_counts(conn):
+    """Изредка сворачивает буфер прямо в запросе; нажатие уже зафиксировано, поэтому сбой flush только пишется в лог"""
+    if random.random() >= REACTION_FLUSH_PROBABILITY:
+        return
+    try:
+        flush_reaction_counts(conn)
+    except Exception as e:
+        print(f'flush_reaction_counts failed: {e}')
+
+def flush_all_reaction_counts(conn, batch_size=REACTION_FLUSH_BATCH, max_seconds=PURGE_MAX_SECONDS) -> int:
+    deadline = time.monotonic() + max_seconds
+    total = 0
+    while time.monotonic() < deadline:
+        flushed = flush_reaction_counts(conn, batch_size)
+        total += flushed
+        if flushed < batch_size:
+            break
+    return total
+
+def cdn_url(key):
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+
+def owned_upload_key(file_url, user_id):
+    """Ключ файла, который send_message загрузил от имени user_id; для чужих и внешних ссылок None"""
+    prefix = cdn_url(f'{UPLOADS_PREFIX}/{int(user_id)}/')
+    if not file_url or not file_url.startswith(prefix):
+        return None
+    return file_url[len(cdn_url('')):]
+
+def enqueue_purge(cur, job_type, user_id, chat_id=None):
+    """Ставит задание очистки в очередь; сообщения скрываются сразу, удаляются воркером"""
+    cur.execute(
+        "INSERT INTO purge_jobs (job_type, user_id, chat_id) VALUES (%s, %s, %s) RETURNING id",
+        (job_type, user_id, chat_id)
+    )
+    return cur.fetchone()[0]
+
+def purge_batch(conn, s3, batch_size=PURGE_BATCH_SIZE):
+    """Удаляет одну пачку сообщений, их реакций и файлов для первого активного задания"""
+    cur = conn.cursor()
+    job = None
+    
+    try:
+        cur.execute("""
+            SELECT id, user_id, chat_id, cutoff_at FROM purge_jobs
+            WHERE status IN ('pending', 'running') AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)
+        job = cur.fetchone()
+        if not job:
+            conn.rollback()
+            return None
+        
+        job_id, job_user_id, job_chat_id, cutoff_at = job
+        chat_filter = 'AND chat_id = %s' if job_chat_id else ''
+        values = (job_user_id,) + ((job_chat_id,) if job_chat_id else ()) + (cutoff_at, batch_size)
+        
+        cur.execute(f"""
+            WITH batch AS (
+                SELECT id, created_at FROM messages
+                WHERE sender_id = %s {chat_filter} AND created_at <= %s
+                LIMIT %s
+            ), reactions AS (
+                DELETE FROM message_reactions WHERE message_id IN (SELECT id FROM batch)
+                RETURNING 1
+            ), reaction_counts AS (
+                DELETE FROM message_reaction_counts WHERE message_id IN (SELECT id FROM batch)
+            ), reaction_deltas AS (
+                DELETE FROM reaction_count_deltas WHERE message_id IN (SELECT id FROM batch)
+            ), deleted AS (
+                DELETE FROM messages m USING batch b
+                WHERE m.id = b.id AND m.created_at = b.created_at
+                RETURNING m.file_url
+            )
+            SELECT (SELECT COUNT(*) FROM deleted), (SELECT COUNT(*) FROM reactions),
+                   ARRAY(SELECT file_url FROM deleted WHERE file_url IS NOT NULL)
+        """, values)
+        purged_messages, purged_reactions, file_urls = cur.fetchone()
+        
+        # Файлы удаляются до фиксации транзакции: при ошибке пачка повторится целиком.
+        # file_url присылает клиент, поэтому удаляем только то, что сами загрузили от имени автора сообщений
+        keys = [key for key in (owned_upload_key(url, job_user_id) for url in file_urls) if key]
+        for i in range(0, len(keys), 1000):
+            s3.delete_objects(Bucket='files', Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True})
+        
+        done = purged_messages == 0
+        cur.execute("""
+            UPDATE purge_jobs
+            SET status = %s,
+                started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+                finished_at = CASE WHEN %s THEN CURRENT_TIMESTAMP END,
+                purged_messages = purged_messages + %s,
+                purged_reactions = purged_reactions + %s,
+                purged_files = purged_files + %s,
+                attempts = 0,
+                error = NULL
+            WHERE id = %s
+        """, ('done' if done else 'running', done, purged_messages, purged_reactions, len(keys), job_id))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        if not job:
+            raise
+        # Повтор с растущей паузой, после PURGE_MAX_ATTEMPTS подряд задание становится failed и не держит очередь
+        cur.execute("""
+            UPDATE purge_jobs
+            SET attempts = attempts + 1,
+                error = %s,
+                status = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE status END,
+                finished_at = CASE WHEN attempts + 1 >= %s THEN CURRENT_TIMESTAMP END,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s * power(2, attempts))
+            WHERE id = %s
+            RETURNING status
+        """, (str(e), PURGE_MAX_ATTEMPTS, PURGE_MAX_ATTEMPTS, PURGE_RETRY_SECONDS, job[0]))
+        status = cur.fetchone()[0]
+        conn.commit()
+        return {'job_id': job[0], 'messages': 0, 'reactions': 0, 'files': 0, 'done': False, 'failed': status == 'failed', 'error': str(e)}
+    finally:
+        cur.close()
+    
+    return {'job_id': job_id, 'messages': purged_messages, 'reactions': purged_reactions, 'files': len(keys), 'done': done, 'failed': False}
+
+def run_purge_jobs(conn, s3, batch_size=PURGE_BATCH_SIZE, pause=PURGE_PAUSE_SECONDS, max_seconds=PURGE_MAX_SECONDS) -> dict:
+    """Обрабатывает очередь очистки пачками с паузами, пока не кончатся задания или время"""
+    deadline = time.monotonic() + max_seconds
+    report = {'batches': 0, 'messages': 0, 'reactions': 0, 'files': 0, 'finished_jobs': [], 'failed_jobs': [], 'errors': 0}
+    
+    while time.monotonic() < deadline:
+        result = purge_batch(conn, s3, batch_size)
+        if result is None:
+            break
+        report['batches'] += 1
+        report['messages'] += result['messages']
+        report['reactions'] += result['reactions']
+        report['files'] += result['files']
+        if result['done']:
+            report['finished_jobs'].append(result['job_id'])
+        if result.get('error'):
+            report['errors'] += 1
+        if result['failed']:
+            report['failed_jobs'].append(result['job_id'])
+        # Пауза между пачками, чтобы не вытеснять запросы send_message
+        time.sleep(pause)
+    
+    return report
 
 def handler(event: dict, context) -> dict:
     """API для управления чатами и сообщениями"""
@@ -26,11 +603,7 @@ def handler(event: dict, context) -> dict:
     conn = psycopg2.connect(db_url)
     cur = conn.cursor()
     
-    s3 = boto3.client('s3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-    )
+    s3 = get_s3_client()
     
     try:
         user_id = event.get('headers', {}).get('X-User-Id') or event.get('headers', {}).get('x-user-id')
@@ -40,10 +613,17 @@ def handler(event: dict, context) -> dict:
             action = params.get('action')
             
             if action == 'list_chats':
-                cur.execute("""
+                # Граница по chats.last_message_at оставляет подзапросу последнего сообщения одну секцию.
+                # Если последнее сообщение скрыто очисткой, вторая ветка ищет предыдущее без границы:
+                # Append с LIMIT 1 выполняет ее, только когда первая ничего не нашла
+                cur.execute(f"""
                     SELECT c.id, c.type, c.name, c.avatar_url, c.created_at,
-                           (SELECT content FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message,
-                           (SELECT COUNT(*) FROM messages WHERE chat_id = c.id AND is_read = FALSE AND sender_id != %s) as unread_count
+                           (SELECT content FROM (
+                               (SELECT m.content FROM messages m WHERE m.chat_id = c.id AND m.created_at >= c.last_message_at AND {NOT_PURGED} ORDER BY m.created_at DESC, m.id DESC LIMIT 1)
+                               UNION ALL
+                               (SELECT m.content FROM messages m WHERE m.chat_id = c.id AND m.created_at < c.last_message_at AND {NOT_PURGED} ORDER BY m.created_at DESC, m.id DESC LIMIT 1)
+                           ) latest LIMIT 1) as last_message,
+                           (SELECT COUNT(*) FROM messages m WHERE m.chat_id = c.id AND m.is_read = FALSE AND m.sender_id != %s AND {NOT_PURGED}) as unread_count
                     FROM chats c
                     JOIN chat_members cm ON c.id = cm.chat_id
                     WHERE cm.user_id = %s AND cm.is_blocked = FALSE
@@ -62,26 +642,50 @@ def handler(event: dict, context) -> dict:
                         'unread_count': row[6]
                     })
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'chats': chats})
-                }
+                return json_response(200, {'chats': chats}, event)
             
             elif action == 'get_messages':
                 chat_id = params.get('chat_id')
+                limit = min(int(params.get('limit', MESSAGES_PAGE_SIZE)), MESSAGES_MAX_PAGE_SIZE)
+                cursor = params.get('cursor')
+                
+                if not get_cached_member_role(cur, chat_id, user_id):
+                    return json_response(403, {'error': 'Forbidden'}, event)
+                
+                rows = fetch_messages_page(cur, chat_id, limit, cursor)
                 
+                next_cursor = None
+                restoring = False
+                if len(rows) > limit:
+                    next_cursor = f"{rows[limit - 1][12].isoformat()}_{rows[limit - 1][0]}"
+                elif cursor or not rows:
+                    # Горячая история кончилась: ставим в очередь архивную секцию с этим чатом, клиент повторит запрос
+                    before = rows[-1][12].isoformat() if rows else (cursor.rpartition('_')[0] if cursor else None)
+                    restoring = request_restore(cur, chat_id, before)
+                    if restoring:
+                        next_cursor = f"{rows[-1][12].isoformat()}_{rows[-1][0]}" if rows else cursor
+                else:
+                    # Неполная первая страница архив не трогает: курсор ведет за старейшее горячее сообщение
+                    next_cursor = f"{rows[-1][12].isoformat()}_{rows[-1][0]}"
+                
+                # Реакции всей страницы одним запросом: счетчики плюс еще не свернутые нажатия из буфера,
+                # чтобы своя реакция была видна сразу, а не после очередного flush
+                reactions = {}
+                page_ids = [row[0] for row in rows[:limit]]
                 cur.execute("""
-                    SELECT m.id, m.sender_id, u.username, u.display_name, u.avatar_url,
-                           m.content, m.message_type, m.file_url, m.duration, m.reply_to, m.is_read, m.is_edited, m.created_at
-                    FROM messages m
-                    JOIN users u ON m.sender_id = u.id
-                    WHERE m.chat_id = %s
-                    ORDER BY m.created_at ASC
-                """, (chat_id,))
+                    SELECT message_id, emoji, SUM(count) FROM (
+                        SELECT message_id, emoji, count FROM message_reaction_counts WHERE message_id = ANY(%s)
+                        UNION ALL
+                        SELECT message_id, emoji, delta FROM reaction_count_deltas WHERE message_id = ANY(%s)
+                    ) r
+                    GROUP BY message_id, emoji
+                    HAVING SUM(count) > 0
+                """, (page_ids, page_ids))
+                for message_id, emoji, count in cur.fetchall():
+                    reactions.setdefault(message_id, []).append({'emoji': emoji, 'count': count})
                 
                 messages = []
-                for row in cur.fetchall():
+                for row in reversed(rows[:limit]):
                     msg = {
                         'id': row[0],
                         'sender_id': row[1],
@@ -95,39 +699,214 @@ def handler(event: dict, context) -> dict:
                         'reply_to': row[9],
                         'is_read': row[10],
                         'is_edited': row[11],
-                        'created_at': row[12].isoformat() if row[12] else None
+                        'created_at': row[12].isoformat() if row[12] else None,
+                        'reactions': reactions.get(row[0], [])
                     }
-                    
-                    cur.execute("""
-                        SELECT emoji, COUNT(*) as count
-                        FROM message_reactions
-                        WHERE message_id = %s
-                        GROUP BY emoji
-                    """, (row[0],))
-                    msg['reactions'] = [{'emoji': r[0], 'count': r[1]} for r in cur.fetchall()]
-                    
                     messages.append(msg)
                 
-                cur.execute("UPDATE messages SET is_read = TRUE WHERE chat_id = %s AND sender_id != %s", (chat_id, user_id))
+                # Частичный индекс idx_messages_unread затрагивает только непрочитанные строки, а граница
+                # по самому старому сообщению страницы оставляет UPDATE в ее секциях: остальные, в том числе
+                # выгружаемые в архив, не получают блокировок записи
+                if rows:
+                    cur.execute(
+                        "UPDATE messages SET is_read = TRUE WHERE chat_id = %s AND sender_id != %s AND is_read = FALSE AND created_at >= %s",
+                        (chat_id, user_id, rows[:limit][-1][12])
+                    )
                 conn.commit()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'messages': messages})
-                }
+                # format=columnar отдает страницу без повтора ключей в каждом сообщении
+                if params.get('format') == 'columnar':
+                    messages = columnar(messages)
+                
+                return json_response(200, {'messages': messages, 'next_cursor': next_cursor, 'restoring': restoring}, event)
+            
+            elif action == 'list_members':
+                chat_id = params.get('chat_id')
+                role = params.get('role')
+                limit = min(int(params.get('limit', MEMBERS_PAGE_SIZE)), MEMBERS_MAX_PAGE_SIZE)
+                cursor = params.get('cursor')
+                
+                if not get_cached_member_role(cur, chat_id, user_id):
+                    return json_response(403, {'error': 'Forbidden'}, event)
+                
+                filters = ''
+                values = [chat_id]
+                if role:
+                    filters += ' AND cm.role = %s'
+                    values.append(role)
+                if cursor:
+                    filters += ' AND cm.id > %s'
+                    values.append(int(cursor))
+                values.append(limit + 1)
+                
+                cur.execute(f"""
+                    SELECT cm.id, cm.user_id, u.username, u.display_name, u.avatar_url, cm.role, cm.joined_at
+                    FROM chat_members cm
+                    JOIN users u ON u.id = cm.user_id
+                    WHERE cm.chat_id = %s AND cm.is_blocked = FALSE {filters}
+                    ORDER BY cm.id
+                    LIMIT %s
+                """, tuple(values))
+                rows = cur.fetchall()
+                
+                members = []
+                for row in rows[:limit]:
+                    members.append({
+                        'user_id': row[1],
+                        'username': row[2],
+                        'display_name': row[3],
+                        'avatar_url': row[4],
+                        'role': row[5],
+                        'joined_at': row[6].isoformat() if row[6] else None
+                    })
+                
+                cur.execute("SELECT member_count FROM chats WHERE id = %s", (chat_id,))
+                member_count = cur.fetchone()[0]
+                
+                return json_response(200, {
+                    'members': members,
+                    'member_count': member_count,
+                    'next_cursor': str(rows[limit - 1][0]) if len(rows) > limit else None
+                }, event)
+            
+            elif action == 'purge_status':
+                job_id = params.get('job_id')
+                
+                cur.execute("""
+                    SELECT id, job_type, chat_id, status, purged_messages, purged_reactions, purged_files, error,
+                           created_at, started_at, finished_at
+                    FROM purge_jobs
+                    WHERE id = %s AND user_id = %s
+                """, (job_id, user_id))
+                job = cur.fetchone()
+                
+                if not job:
+                    return json_response(404, {'error': 'Job not found'}, event)
+                
+                return json_response(200, {
+                    'job_id': job[0],
+                    'job_type': job[1],
+                    'chat_id': job[2],
+                    'status': job[3],
+                    'purged_messages': job[4],
+                    'purged_reactions': job[5],
+                    'purged_files': job[6],
+                    'error': job[7],
+                    'created_at': job[8].isoformat() if job[8] else None,
+                    'started_at': job[9].isoformat() if job[9] else None,
+                    'finished_at': job[10].isoformat() if job[10] else None
+                }, event)
+            
+            elif action == 'search_messages':
+                query = (params.get('query') or '').strip()
+                chat_id = params.get('chat_id')
+                limit = min(int(params.get('limit', SEARCH_PAGE_SIZE)), SEARCH_MAX_PAGE_SIZE)
+                cursor = params.get('cursor')
+                
+                if not query:
+                    return json_response(400, {'error': 'Query is required'}, event)
+                
+                filters = ''
+                values = [query, query, user_id]
+                if chat_id:
+                    filters += ' AND m.chat_id = %s'
+                    values.append(chat_id)
+                
+                keyset = ''
+                if cursor:
+                    cursor_rank, _, cursor_id = cursor.rpartition('_')
+                    keyset = 'WHERE (rank, id) < (%s::real, %s)'
+                    values.extend([float(cursor_rank), int(cursor_id)])
+                values.append(limit + 1)
+                
+                # Поиск идет по GIN-индексу search_vector, сниппеты строятся только для строк страницы.
+                # Текст экранируется до ts_headline: в сниппете остается только разметка <mark>
+                cur.execute(f"""
+                    WITH q AS (
+                        SELECT websearch_to_tsquery('russian', %s) || websearch_to_tsquery('english', %s) AS query
+                    ), hits AS (
+                        SELECT m.id, m.chat_id, m.sender_id, m.content, m.created_at, ts_rank(m.search_vector, q.query) AS rank
+                        FROM messages m, q
+                        WHERE m.search_vector @@ q.query
+                          AND m.chat_id IN (SELECT chat_id FROM chat_members WHERE user_id = %s AND is_blocked = FALSE)
+                          AND {NOT_PURGED}
+                          {filters}
+                    )
+                    SELECT h.id, h.chat_id, c.name, h.sender_id, u.username, u.display_name, h.created_at, h.rank,
+                           ts_headline('russian',
+                                       replace(replace(replace(replace(replace(h.content, '&', '&amp;'), '<', '&lt;'), '>', '&gt;'), '"', '&quot;'), '''', '&#39;'),
+                                       q.query, 'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5')
+                    FROM (SELECT * FROM hits {keyset} ORDER BY rank DESC, id DESC LIMIT %s) h
+                    CROSS JOIN q
+                    JOIN chats c ON c.id = h.chat_id
+                    JOIN users u ON u.id = h.sender_id
+                    ORDER BY h.rank DESC, h.id DESC
+                """, tuple(values))
+                rows = cur.fetchall()
+                
+                results = []
+                for row in rows[:limit]:
+                    results.append({
+                        'id': row[0],
+                        'chat_id': row[1],
+                        'chat_name': row[2],
+                        'sender_id': row[3],
+                        'sender_username': row[4],
+                        'sender_name': row[5],
+                        'created_at': row[6].isoformat() if row[6] else None,
+                        'rank': row[7],
+                        'snippet': row[8]
+                    })
+                
+                next_cursor = None
+                if len(rows) > limit:
+                    next_cursor = f"{rows[limit - 1][7]!r}_{rows[limit - 1][0]}"
+                
+                return json_response(200, {'messages': results, 'next_cursor': next_cursor}, event)
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
             action = body.get('action')
             
-            if action == 'create_chat':
+            if action == 'run_purge_jobs':
+                token = event.get('headers', {}).get('X-Worker-Token') or event.get('headers', {}).get('x-worker-token')
+                
+                if not os.environ.get('PURGE_WORKER_TOKEN') or token != os.environ['PURGE_WORKER_TOKEN']:
+                    return json_response(403, {'success': False, 'error': 'Forbidden'}, event)
+                
+                report = run_purge_jobs(
+                    conn, s3,
+                    batch_size=int(body.get('batch_size', PURGE_BATCH_SIZE)),
+                    pause=float(body.get('pause', PURGE_PAUSE_SECONDS)),
+                    max_seconds=float(body.get('max_seconds', PURGE_MAX_SECONDS))
+                )
+                
+                return json_response(200, {'success': True, 'report': report}, event)
+            
+            elif action == 'run_restores':
+                token = event.get('headers', {}).get('X-Worker-Token') or event.get('headers', {}).get('x-worker-token')
+                
+                if not os.environ.get('PURGE_WORKER_TOKEN') or token != os.environ['PURGE_WORKER_TOKEN']:
+                    return json_response(403, {'success': False, 'error': 'Forbidden'}, event)
+                
+                report = restore_requested_partitions(conn, s3, max_seconds=float(body.get('max_seconds', PURGE_MAX_SECONDS)))
+                
+                return json_response(200, {'success': True, 'report': report}, event)
+            
+            elif action == 'create_chat':
                 chat_type = body.get('type')
                 name = body.get('name')
-                members = body.get('members', [])
+                members = parse_user_ids(body.get('members', []))
+                
+                if members is None:
+                    return json_response(400, {'success': False, 'error': 'members must be a list of user ids'}, event)
+                
+                members = [m for m in members if str(m) != str(user_id)]
+                if len(members) > MAX_BULK_MEMBERS:
+                    return json_response(400, {'success': False, 'error': f'At most {MAX_BULK_MEMBERS} members per request'}, event)
                 
                 cur.execute(
-                    "INSERT INTO chats (type, name, created_by) VALUES (%s, %s, %s) RETURNING id",
+                    "INSERT INTO chats (type, name, created_by, member_count) VALUES (%s, %s, %s, 1) RETURNING id",
                     (chat_type, name, user_id)
                 )
                 chat_id = cur.fetchone()[0]
@@ -137,19 +916,64 @@ def handler(event: dict, context) -> dict:
                     (chat_id, user_id)
                 )
                 
-                for member_id in members:
-                    cur.execute(
-                        "INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s)",
-                        (chat_id, member_id)
-                    )
+                added = add_members(cur, chat_id, members) if members else 0
                 
                 conn.commit()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'chat_id': chat_id})
-                }
+                return json_response(200, {'success': True, 'chat_id': chat_id, 'added': added, 'skipped': len(members) - added}, event)
+            
+            elif action in ('add_members', 'remove_members', 'block_members', 'unblock_members'):
+                chat_id = body.get('chat_id')
+                member_ids = parse_user_ids(body.get('user_ids'))
+                role = body.get('role', 'member')
+                
+                if member_ids is None:
+                    return json_response(400, {'success': False, 'error': 'user_ids must be a list of user ids'}, event)
+                
+                caller_role = get_member_role(cur, chat_id, user_id)
+                
+                if caller_role not in ('owner', 'admin') or (role == 'admin' and caller_role != 'owner') or role not in ('member', 'admin'):
+                    return json_response(403, {'success': False, 'error': 'Forbidden'}, event)
+                
+                if len(member_ids) > MAX_BULK_MEMBERS:
+                    return json_response(400, {'success': False, 'error': f'At most {MAX_BULK_MEMBERS} members per request'}, event)
+                
+                if action == 'add_members':
+                    changed = add_members(cur, chat_id, member_ids, role)
+                elif action == 'remove_members':
+                    changed = remove_members(cur, chat_id, member_ids)
+                else:
+                    changed = set_members_blocked(cur, chat_id, member_ids, action == 'block_members')
+                conn.commit()
+                invalidate_membership(chat_id, member_ids)
+                
+                if action == 'add_members':
+                    # Пропущены несуществующие пользователи и уже состоящие в чате
+                    return json_response(200, {'success': True, 'changed': changed, 'added': changed, 'skipped': len(member_ids) - changed}, event)
+                return json_response(200, {'success': True, 'changed': changed}, event)
+            
+            elif action == 'join_chat':
+                chat_id = body.get('chat_id')
+                
+                cur.execute("SELECT type FROM chats WHERE id = %s", (chat_id,))
+                chat = cur.fetchone()
+                
+                if not chat or chat[0] not in JOINABLE_CHAT_TYPES:
+                    return json_response(404, {'success': False, 'error': 'Chat not found'}, event)
+                
+                joined = add_members(cur, chat_id, [int(user_id)])
+                conn.commit()
+                invalidate_membership(chat_id, [user_id])
+                
+                return json_response(200, {'success': True, 'joined': joined > 0}, event)
+            
+            elif action == 'leave_chat':
+                chat_id = body.get('chat_id')
+                left = remove_members(cur, chat_id, [int(user_id)], keep_blocked=True)
+                conn.commit()
+                invalidate_membership(chat_id, [user_id])
+                
+                return json_response(200, {'success': True, 'left': left > 0}, event)
             
             elif action == 'send_message':
                 chat_id = body.get('chat_id')
@@ -161,11 +985,16 @@ def handler(event: dict, context) -> dict:
                 duration = body.get('duration')
                 reply_to = body.get('reply_to')
                 
+                # Кэш отсекает чужих до загрузки файла; окончательная проверка — в самом INSERT
+                if not get_cached_member_role(cur, chat_id, user_id):
+                    return json_response(403, {'success': False, 'error': 'Forbidden'}, event)
+                
                 if file_data:
                     file_bytes = base64.b64decode(file_data)
                     file_ext = 'jpg' if 'image' in file_type else 'ogg'
                     unique_name = f"{uuid.uuid4()}.{file_ext}"
-                    key = f"uploads/{datetime.now().year}/{datetime.now().month}/{unique_name}"
+                    # Автор в ключе: очистка удалит файл, только если он загружен этим же пользователем
+                    key = f"{UPLOADS_PREFIX}/{int(user_id)}/{datetime.now().year}/{datetime.now().month}/{unique_name}"
                     
                     s3.put_object(
                         Bucket='files',
@@ -174,40 +1003,87 @@ def handler(event: dict, context) -> dict:
                         ContentType=file_type
                     )
                     
-                    file_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+                    file_url = cdn_url(key)
                 
-                cur.execute(
-                    "INSERT INTO messages (chat_id, sender_id, content, message_type, file_url, duration, reply_to) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id, created_at",
-                    (chat_id, user_id, content, message_type, file_url, duration, reply_to)
-                )
+                cur.execute("""
+                    WITH sent AS (
+                        INSERT INTO messages (chat_id, sender_id, content, message_type, file_url, duration, reply_to)
+                        SELECT %s, %s, %s, %s, %s, %s, %s
+                        WHERE EXISTS (
+                            SELECT 1 FROM chat_members
+                            WHERE user_id = %s AND chat_id = %s AND is_blocked = FALSE
+                        )
+                        RETURNING id, created_at
+                    ), touched AS (
+                        UPDATE chats SET last_message_at = GREATEST(last_message_at, sent.created_at)
+                        FROM sent
+                        WHERE chats.id = %s
+                    )
+                    SELECT id, created_at FROM sent
+                """, (chat_id, user_id, content, message_type, file_url, duration, reply_to, user_id, chat_id, chat_id))
                 result = cur.fetchone()
                 conn.commit()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'message_id': result[0],
-                        'created_at': result[1].isoformat()
-                    })
-                }
+                if not result:
+                    invalidate_membership(chat_id, [user_id])
+                    return json_response(403, {'success': False, 'error': 'Forbidden'}, event)
+                
+                return json_response(200, {
+                    'success': True,
+                    'message_id': result[0],
+                    'created_at': result[1].isoformat()
+                }, event)
             
             elif action == 'add_reaction':
                 message_id = body.get('message_id')
                 emoji = body.get('emoji')
                 
-                cur.execute(
-                    "INSERT INTO message_reactions (message_id, user_id, emoji) VALUES (%s, %s, %s) ON CONFLICT (message_id, user_id, emoji) DO NOTHING",
-                    (message_id, user_id, emoji)
-                )
+                # Чат известен только по сообщению, поэтому членство проверяется в том же запросе, что и вставка.
+                # Счетчик не трогаем: пишем +1 в буфер, чтобы нажатия по горячему посту не ждали блокировку строки
+                cur.execute("""
+                    WITH allowed AS (
+                        SELECT 1 FROM messages m
+                        JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.user_id = %s AND cm.is_blocked = FALSE
+                        WHERE m.id = %s
+                    ), added AS (
+                        INSERT INTO message_reactions (message_id, user_id, emoji)
+                        SELECT %s, %s, %s WHERE EXISTS (SELECT 1 FROM allowed)
+                        ON CONFLICT (message_id, user_id, emoji) DO NOTHING
+                        RETURNING message_id, emoji
+                    ), buffered AS (
+                        INSERT INTO reaction_count_deltas (message_id, emoji, delta)
+                        SELECT message_id, emoji, 1 FROM added
+                    )
+                    SELECT EXISTS (SELECT 1 FROM allowed)
+                """, (user_id, message_id, message_id, user_id, emoji))
+                allowed = cur.fetchone()[0]
+                conn.commit()
+                
+                if not allowed:
+                    return json_response(403, {'success': False, 'error': 'Forbidden'}, event)
+                
+                maybe_flush_reaction_counts(conn)
+                
+                return json_response(200, {'success': True}, event)
+            
+            elif action == 'remove_reaction':
+                message_id = body.get('message_id')
+                emoji = body.get('emoji')
+                
+                cur.execute("""
+                    WITH removed AS (
+                        DELETE FROM message_reactions
+                        WHERE message_id = %s AND user_id = %s AND emoji = %s
+                        RETURNING message_id, emoji
+                    )
+                    INSERT INTO reaction_count_deltas (message_id, emoji, delta)
+                    SELECT message_id, emoji, -1 FROM removed
+                """, (message_id, user_id, emoji))
                 conn.commit()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
-                }
+                maybe_flush_reaction_counts(conn)
+                
+                return json_response(200, {'success': True}, event)
         
         elif method == 'DELETE':
             params = event.get('queryStringParameters', {}) or {}
@@ -215,21 +1091,60 @@ def handler(event: dict, context) -> dict:
             
             if action == 'clear_chat':
                 chat_id = params.get('chat_id')
-                cur.execute("UPDATE messages SET content = '', message_type = 'text' WHERE chat_id = %s AND sender_id = %s", (chat_id, user_id))
+                
+                if not get_cached_member_role(cur, chat_id, user_id):
+                    return json_response(403, {'success': False, 'error': 'Forbidden'}, event)
+                
+                job_id = enqueue_purge(cur, 'clear_chat', user_id, chat_id)
+                conn.commit()
+                
+                return json_response(200, {'success': True, 'job_id': job_id}, event)
+            
+            elif action == 'delete_my_messages':
+                job_id = enqueue_purge(cur, 'delete_account_messages', user_id)
                 conn.commit()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
-                }
+                return json_response(200, {'success': True, 'job_id': job_id}, event)
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return json_response(405, {'error': 'Method not allowed'}, event)
     
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+if __name__ == '__main__':
+    # Обслуживание messages: python index.py archive --older-than-months 6, python index.py purge
+    parser = argparse.ArgumentParser(description='Обслуживание таблицы messages')
+    commands = parser.add_subparsers(dest='command', required=True)
+    archive_cmd = commands.add_parser('archive', help='вынести старые секции в холодное хранилище')
+    archive_cmd.add_argument('--older-than-months', type=int, default=6)
+    restore_cmd = commands.add_parser('restore', help='вернуть секцию из холодного хранилища')
+    restore_cmd.add_argument('partition', nargs='?', help='без имени обрабатывается очередь восстановления')
+    maintain_cmd = commands.add_parser('maintain', help='создать секции на будущие месяцы')
+    maintain_cmd.add_argument('--months-ahead', type=int, default=3)
+    purge_cmd = commands.add_parser('purge', help='обработать очередь очистки сообщений')
+    purge_cmd.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE)
+    purge_cmd.add_argument('--pause', type=float, default=PURGE_PAUSE_SECONDS)
+    purge_cmd.add_argument('--max-seconds', type=float, default=PURGE_MAX_SECONDS)
+    flush_cmd = commands.add_parser('flush-reactions', help='свернуть буфер нажатий в счетчики реакций')
+    flush_cmd.add_argument('--batch-size', type=int, default=REACTION_FLUSH_BATCH)
+    args = parser.parse_args()
+    
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    s3 = None if os.environ.get('MESSAGES_ARCHIVE_DIR') else get_s3_client()
+    try:
+        if args.command == 'archive':
+            result = archive_old_partitions(conn, s3, args.older_than_months)
+        elif args.command == 'restore' and args.partition:
+            result = restore_partition(conn, s3, args.partition)
+        elif args.command == 'restore':
+            result = restore_requested_partitions(conn, s3)
+        elif args.command == 'purge':
+            result = run_purge_jobs(conn, get_s3_client(), args.batch_size, args.pause, args.max_seconds)
+        elif args.command == 'flush-reactions':
+            result = flush_all_reaction_counts(conn, args.batch_size)
+        else:
+            result = create_upcoming_partitions(conn, args.months_ahead)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    finally:
+        conn.close()
@@ -0,0 +1,63 @@
+import base64
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Меньшие тела дешевле отдать как есть, чем сжимать
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+def dumps(payload) -> bytes:
+    """Компактный JSON в UTF-8: orjson, если установлен, иначе стандартный json"""
+    if orjson:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+
+def columnar(items: list) -> dict:
+    """Список одинаковых объектов в виде {'columns': [...], 'rows': [[...]]} без повтора ключей"""
+    if not items:
+        return {'columns': [], 'rows': []}
+    columns = list(items[0].keys())
+    return {'columns': columns, 'rows': [[item.get(column) for column in columns] for item in items]}
+
+def accepted_encodings(event) -> str:
+    headers = (event or {}).get('headers') or {}
+    return (headers.get('Accept-Encoding') or headers.get('accept-encoding') or '').lower()
+
+def json_response(status_code, payload, event=None) -> dict:
+    """Ответ функции с JSON-телом; крупные тела сжимаются brotli или gzip согласно Accept-Encoding"""
+    body = dumps(payload)
+    headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+    
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encodings = accepted_encodings(event)
+        encoded = None
+        if brotli and 'br' in encodings:
+            encoded, headers['Content-Encoding'] = brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+        elif 'gzip' in encodings:
+            encoded, headers['Content-Encoding'] = gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+        
+        if encoded is not None:
+            headers['Vary'] = 'Accept-Encoding'
+            return {
+                'statusCode': status_code,
+                'headers': headers,
+                'body': base64.b64encode(encoded).decode(),
+                'isBase64Encoded': True
+            }
+    
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': body.decode()
+    }
@@ -2,7 +2,143 @@ import json
 import os
 import psycopg2
 import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from decimal import Decimal
 from yookassa import Configuration, Payment
+from serialization import json_response
+
+PAYMENT_FINAL_STATUSES = ('succeeded', 'canceled')
+RECONCILE_BATCH_SIZE = 100
+RECONCILE_MAX_WORKERS = 8
+RECONCILE_TIMEOUT = 15
+RECONCILE_MIN_AGE_MINUTES = 10
+
+def configure_yookassa():
+    Configuration.account_id = os.environ.get('YOOKASSA_SHOP_ID')
+    Configuration.secret_key = os.environ.get('YOOKASSA_SECRET_KEY')
+    # Для локальных прогонов SDK направляется на заглушку API ЮKassa (tests/yookassa_mock.py)
+    if os.environ.get('YOOKASSA_API_URL'):
+        Configuration.api_url = os.environ['YOOKASSA_API_URL']
+
+def apply_payment_status(cur, payment) -> bool:
+    """Сохраняет статус платежа ЮKassa и зачисляет успешный платеж на баланс ровно один раз"""
+    metadata = payment.metadata or {}
+    cur.execute("""
+        INSERT INTO payments (payment_id, user_id, amount, currency, status)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (payment_id) DO UPDATE
+        SET status = EXCLUDED.status, updated_at = CURRENT_TIMESTAMP
+        WHERE payments.status NOT IN ('succeeded', 'canceled')
+    """, (payment.id, metadata.get('user_id'), payment.amount.value, payment.amount.currency, payment.status))
+    
+    if payment.status != 'succeeded':
+        return False
+    
+    cur.execute("""
+        WITH credited AS (
+            UPDATE payments SET credited_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE payment_id = %s AND status = 'succeeded' AND credited_at IS NULL
+            RETURNING user_id, amount
+        )
+        UPDATE users SET balance = balance + credited.amount
+        FROM credited
+        WHERE users.id = credited.user_id
+        RETURNING users.id
+    """, (payment.id,))
+    return cur.fetchone() is not None
+
+def fetch_payments(executor, payment_ids, timeout):
+    """Параллельно запрашивает платежи в ЮKassa, ожидая пачку не дольше timeout секунд"""
+    futures = {executor.submit(Payment.find_one, payment_id): payment_id for payment_id in payment_ids}
+    done, not_done = wait(futures, timeout=timeout)
+    # Не начатые запросы снимаем, чтобы они не занимали пул в следующей пачке
+    for future in not_done:
+        future.cancel()
+    
+    results = {}
+    for future in done:
+        results[futures[future]] = future.exception() or future.result()
+    return results
+
+def reconcile_payments(conn, batch_size=RECONCILE_BATCH_SIZE, max_workers=RECONCILE_MAX_WORKERS,
+                       timeout=RECONCILE_TIMEOUT, min_age_minutes=RECONCILE_MIN_AGE_MINUTES) -> dict:
+    """Сверяет незавершенные платежи с ЮKassa пачками и возвращает отчет о зачислениях и расхождениях"""
+    report = {
+        'checked': 0,
+        'credited': 0,
+        'credited_amount': 0.0,
+        'statuses': {},
+        'timeouts': 0,
+        'errors': 0,
+        'drift': []
+    }
+    keyset = ''
+    last_seen = ()
+    cur = conn.cursor()
+    # Один пул на весь прогон: зависшие запросы прошлых пачек занимают те же max_workers потоков
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    
+    try:
+        while True:
+            # SKIP LOCKED позволяет запускать несколько воркеров одновременно
+            cur.execute(f"""
+                SELECT payment_id, amount, created_at
+                FROM payments
+                WHERE status IN ('pending', 'waiting_for_capture')
+                  AND created_at < CURRENT_TIMESTAMP - make_interval(mins => %s) {keyset}
+                ORDER BY created_at, payment_id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (min_age_minutes,) + last_seen + (batch_size,))
+            rows = cur.fetchall()
+            
+            if not rows:
+                break
+            
+            results = fetch_payments(executor, [row[0] for row in rows], timeout)
+            
+            for payment_id, local_amount, _ in rows:
+                report['checked'] += 1
+                payment = results.get(payment_id)
+                
+                if payment is None:
+                    report['timeouts'] += 1
+                    continue
+                if isinstance(payment, Exception):
+                    report['errors'] += 1
+                    continue
+                
+                report['statuses'][payment.status] = report['statuses'].get(payment.status, 0) + 1
+                provider_amount = Decimal(str(payment.amount.value))
+                if provider_amount != local_amount:
+                    report['drift'].append({
+                        'payment_id': payment_id,
+                        'reason': 'amount_mismatch',
+                        'local_amount': float(local_amount),
+                        'provider_amount': float(provider_amount)
+                    })
+                
+                if apply_payment_status(cur, payment):
+                    report['credited'] += 1
+                    report['credited_amount'] += float(local_amount)
+                elif payment.status == 'succeeded':
+                    cur.execute("SELECT credited_at FROM payments WHERE payment_id = %s", (payment_id,))
+                    if cur.fetchone()[0] is None:
+                        report['drift'].append({
+                            'payment_id': payment_id,
+                            'reason': 'succeeded_not_credited',
+                            'provider_amount': float(provider_amount)
+                        })
+            
+            conn.commit()
+            keyset = 'AND (created_at, payment_id) > (%s, %s)'
+            last_seen = (rows[-1][2], rows[-1][0])
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        conn.rollback()
+        cur.close()
+    
+    return report
 
 def handler(event: dict, context) -> dict:
     """API для приема платежей через ЮKassa"""
@@ -20,8 +156,7 @@ def handler(event: dict, context) -> dict:
             'body': ''
         }
     
-    Configuration.account_id = os.environ.get('YOOKASSA_SHOP_ID')
-    Configuration.secret_key = os.environ.get('YOOKASSA_SECRET_KEY')
+    configure_yookassa()
     
     db_url = os.environ['DATABASE_URL']
     conn = psycopg2.connect(db_url)
@@ -34,6 +169,34 @@ def handler(event: dict, context) -> dict:
             body = json.loads(event.get('body', '{}'))
             action = body.get('action')
             
+            # HTTP-уведомление ЮKassa о смене статуса платежа
+            if body.get('type') == 'notification':
+                payment_id = (body.get('object') or {}).get('id')
+                
+                if not payment_id or not isinstance(payment_id, str):
+                    return json_response(400, {'error': 'Payment id is required'}, event)
+                
+                cur.execute("SELECT status FROM payments WHERE payment_id = %s", (payment_id,))
+                local = cur.fetchone()
+                
+                # Все платежи создаются через create_payment, поэтому незнакомый id не стоит запроса к ЮKassa
+                if not local:
+                    return json_response(200, {'success': True, 'ignored': True}, event)
+                
+                # Повторная доставка уже обработанного уведомления не требует запроса к ЮKassa
+                if local[0] not in PAYMENT_FINAL_STATUSES:
+                    # Статус берем из API, а не из тела уведомления, чтобы его нельзя было подделать
+                    try:
+                        payment = Payment.find_one(payment_id)
+                    except Exception:
+                        # Не 200: ЮKassa повторит уведомление позже, а сверка подберет платеж в любом случае
+                        return json_response(502, {'error': 'Payment provider unavailable'}, event)
+                    
+                    apply_payment_status(cur, payment)
+                    conn.commit()
+                
+                return json_response(200, {'success': True}, event)
+            
             if action == 'create_payment':
                 amount = body.get('amount')
                 
@@ -53,60 +216,65 @@ def handler(event: dict, context) -> dict:
                     }
                 }, uuid.uuid4())
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'payment_id': payment.id,
-                        'confirmation_url': payment.confirmation.confirmation_url
-                    })
-                }
+                cur.execute(
+                    "INSERT INTO payments (payment_id, user_id, amount, currency, status) VALUES (%s, %s, %s, %s, %s) ON CONFLICT (payment_id) DO NOTHING",
+                    (payment.id, user_id, payment.amount.value, payment.amount.currency, payment.status)
+                )
+                conn.commit()
+                
+                return json_response(200, {
+                    'success': True,
+                    'payment_id': payment.id,
+                    'confirmation_url': payment.confirmation.confirmation_url
+                }, event)
+            
+            elif action == 'reconcile':
+                token = event.get('headers', {}).get('X-Reconcile-Token') or event.get('headers', {}).get('x-reconcile-token')
+                
+                if not os.environ.get('RECONCILE_TOKEN') or token != os.environ['RECONCILE_TOKEN']:
+                    return json_response(403, {'success': False, 'error': 'Forbidden'}, event)
+                
+                report = reconcile_payments(
+                    conn,
+                    batch_size=int(body.get('batch_size', RECONCILE_BATCH_SIZE)),
+                    max_workers=int(body.get('max_workers', RECONCILE_MAX_WORKERS)),
+                    timeout=float(body.get('timeout', RECONCILE_TIMEOUT)),
+                    min_age_minutes=int(body.get('min_age_minutes', RECONCILE_MIN_AGE_MINUTES))
+                )
+                
+                return json_response(200, {'success': True, 'report': report}, event)
             
             elif action == 'check_payment':
                 payment_id = body.get('payment_id')
                 
-                payment = Payment.find_one(payment_id)
+                # Статус читается только из локальной таблицы, ее обновляет webhook
+                cur.execute(
+                    "SELECT status, amount, credited_at FROM payments WHERE payment_id = %s AND user_id = %s",
+                    (payment_id, user_id)
+                )
+                payment = cur.fetchone()
                 
-                if payment.status == 'succeeded':
-                    amount = float(payment.amount.value)
-                    user_id = int(payment.metadata.get('user_id'))
-                    
-                    cur.execute("SELECT balance FROM users WHERE id = %s", (user_id,))
-                    current_balance = cur.fetchone()
-                    
-                    if current_balance:
-                        cur.execute(
-                            "UPDATE users SET balance = balance + %s WHERE id = %s",
-                            (amount, user_id)
-                        )
-                        conn.commit()
-                        
-                        return {
-                            'statusCode': 200,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({
-                                'success': True,
-                                'status': 'succeeded',
-                                'amount': amount
-                            })
-                        }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'status': payment.status
-                    })
-                }
+                if not payment:
+                    return json_response(404, {'success': False, 'error': 'Payment not found'}, event)
+                
+                return json_response(200, {
+                    'success': True,
+                    'status': payment[0],
+                    'amount': float(payment[1]),
+                    'credited': payment[2] is not None
+                }, event)
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return json_response(405, {'error': 'Method not allowed'}, event)
     
     finally:
         cur.close()
         conn.close()
+
+if __name__ == '__main__':
+    # Запуск сверки вручную или по расписанию: python index.py
+    configure_yookassa()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        print(json.dumps(reconcile_payments(conn), ensure_ascii=False, indent=2))
+    finally:
+        conn.close()
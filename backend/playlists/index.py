@@ -0,0 +1,346 @@
+import json
+import os
+import psycopg2
+from serialization import json_response, columnar
+
+PLAYLISTS_PAGE_SIZE = 50
+PLAYLISTS_MAX_PAGE_SIZE = 200
+TRACKS_PAGE_SIZE = 200
+TRACKS_MAX_PAGE_SIZE = 1000
+MAX_BULK_TRACKS = 5000
+MAX_MOVES = 500
+POSITION_GAP = 65536
+
+def lock_playlist(cur, playlist_id, user_id):
+    """Блокирует плейлист владельца: правки одного плейлиста идут по очереди. None, если плейлист чужой"""
+    cur.execute(
+        "SELECT id FROM music_playlists WHERE id = %s AND user_id = %s FOR UPDATE",
+        (playlist_id, user_id)
+    )
+    result = cur.fetchone()
+    return result[0] if result else None
+
+def renumber_positions(cur, playlist_id):
+    """Раздает позиции заново с шагом POSITION_GAP; нужно, только когда соседние позиции сошлись вплотную"""
+    cur.execute("""
+        UPDATE playlist_tracks pt
+        SET position = r.n * %s
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY position, id) AS n FROM playlist_tracks WHERE playlist_id = %s
+        ) r
+        WHERE pt.id = r.id
+    """, (POSITION_GAP, playlist_id))
+
+def neighbour_positions(cur, playlist_id, track_id, after_track_id):
+    """Позиции, между которыми встанет track_id: after_track_id (None — начало) и следующий трек; два индексных чтения"""
+    lower = None
+    if after_track_id is not None:
+        cur.execute(
+            "SELECT position FROM playlist_tracks WHERE playlist_id = %s AND track_id = %s ORDER BY position LIMIT 1",
+            (playlist_id, after_track_id)
+        )
+        result = cur.fetchone()
+        if not result:
+            return None
+        lower = result[0]
+    
+    cur.execute(f"""
+        SELECT position FROM playlist_tracks
+        WHERE playlist_id = %s AND track_id != %s {'AND position > %s' if lower is not None else ''}
+        ORDER BY position LIMIT 1
+    """, (playlist_id, track_id) + ((lower,) if lower is not None else ()))
+    result = cur.fetchone()
+    return lower, result[0] if result else None
+
+def move_track(cur, playlist_id, track_id, after_track_id):
+    """Переносит трек, меняя одну строку; если промежуток между соседями исчерпан, сначала перенумеровывает плейлист"""
+    if track_id == after_track_id:
+        return False
+    
+    neighbours = neighbour_positions(cur, playlist_id, track_id, after_track_id)
+    if neighbours is None:
+        return False
+    
+    lower, upper = neighbours
+    if lower is not None and upper is not None and upper - lower < 2:
+        renumber_positions(cur, playlist_id)
+        lower, upper = neighbour_positions(cur, playlist_id, track_id, after_track_id)
+    
+    if lower is None and upper is None:
+        position = POSITION_GAP
+    elif upper is None:
+        position = lower + POSITION_GAP
+    elif lower is None:
+        position = upper - POSITION_GAP
+    else:
+        position = (lower + upper) // 2
+    
+    cur.execute(
+        "UPDATE playlist_tracks SET position = %s WHERE playlist_id = %s AND track_id = %s",
+        (position, playlist_id, track_id)
+    )
+    return cur.rowcount > 0
+
+def add_tracks(cur, playlist_id, tracks):
+    """Добавляет треки в конец плейлиста одним запросом, пропуская уже добавленные; плейлист должен быть заблокирован"""
+    cur.execute("""
+        WITH tail AS (
+            SELECT COALESCE(MAX(position), 0) AS position FROM playlist_tracks WHERE playlist_id = %s
+        ), incoming AS (
+            SELECT DISTINCT ON (t.track_id) t.*
+            FROM unnest(%s::text[], %s::text[], %s::text[], %s::int[]) WITH ORDINALITY AS t(track_id, track_name, artist, duration, n)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM playlist_tracks pt WHERE pt.playlist_id = %s AND pt.track_id = t.track_id
+            )
+            ORDER BY t.track_id, t.n
+        ), added AS (
+            INSERT INTO playlist_tracks (playlist_id, track_id, track_name, artist, duration, position)
+            SELECT %s, i.track_id, i.track_name, i.artist, i.duration, tail.position + %s * ROW_NUMBER() OVER (ORDER BY i.n)
+            FROM incoming i, tail
+            RETURNING 1
+        )
+        UPDATE music_playlists SET track_count = track_count + (SELECT COUNT(*) FROM added)
+        WHERE id = %s
+        RETURNING (SELECT COUNT(*) FROM added)
+    """, (
+        playlist_id,
+        [str(track.get('track_id')) for track in tracks],
+        [track.get('track_name') for track in tracks],
+        [track.get('artist') for track in tracks],
+        [track.get('duration') for track in tracks],
+        playlist_id, playlist_id, POSITION_GAP, playlist_id
+    ))
+    result = cur.fetchone()
+    return result[0] if result else 0
+
+def remove_tracks(cur, playlist_id, track_ids):
+    """Удаляет треки одним DELETE и возвращает их число"""
+    cur.execute("""
+        WITH removed AS (
+            DELETE FROM playlist_tracks
+            WHERE playlist_id = %s AND track_id = ANY(%s::text[])
+            RETURNING 1
+        )
+        UPDATE music_playlists SET track_count = track_count - (SELECT COUNT(*) FROM removed)
+        WHERE id = %s
+        RETURNING (SELECT COUNT(*) FROM removed)
+    """, (playlist_id, [str(track_id) for track_id in track_ids], playlist_id))
+    result = cur.fetchone()
+    return result[0] if result else 0
+
+def track_to_dict(row):
+    return {
+        'track_id': row[0],
+        'track_name': row[1],
+        'artist': row[2],
+        'duration': row[3],
+        'position': row[4],
+        'added_at': row[5].isoformat() if row[5] else None
+    }
+
+def handler(event: dict, context) -> dict:
+    """API для музыкальных плейлистов: списки, треки, массовое добавление, удаление и перенос"""
+    
+    method = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
+            },
+            'body': ''
+        }
+    
+    db_url = os.environ['DATABASE_URL']
+    conn = psycopg2.connect(db_url)
+    cur = conn.cursor()
+    
+    try:
+        user_id = event.get('headers', {}).get('X-User-Id') or event.get('headers', {}).get('x-user-id')
+        
+        if method == 'GET':
+            params = event.get('queryStringParameters', {}) or {}
+            action = params.get('action')
+            
+            if action == 'list_playlists':
+                limit = min(int(params.get('limit', PLAYLISTS_PAGE_SIZE)), PLAYLISTS_MAX_PAGE_SIZE)
+                cursor = params.get('cursor')
+                
+                keyset = ''
+                values = (user_id,)
+                if cursor:
+                    cursor_created_at, _, cursor_id = cursor.rpartition('_')
+                    keyset = 'AND (created_at, id) < (%s, %s)'
+                    values += (cursor_created_at, int(cursor_id))
+                
+                cur.execute(f"""
+                    SELECT id, name, track_count, created_at FROM music_playlists
+                    WHERE user_id = %s {keyset}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, values + (limit + 1,))
+                rows = cur.fetchall()
+                
+                playlists = [
+                    {'id': row[0], 'name': row[1], 'track_count': row[2], 'created_at': row[3].isoformat() if row[3] else None}
+                    for row in rows[:limit]
+                ]
+                
+                next_cursor = None
+                if len(rows) > limit:
+                    next_cursor = f"{rows[limit - 1][3].isoformat()}_{rows[limit - 1][0]}"
+                
+                return json_response(200, {'playlists': playlists, 'next_cursor': next_cursor}, event)
+            
+            elif action == 'get_tracks':
+                playlist_id = params.get('playlist_id')
+                limit = min(int(params.get('limit', TRACKS_PAGE_SIZE)), TRACKS_MAX_PAGE_SIZE)
+                cursor = params.get('cursor')
+                
+                cur.execute("SELECT name, track_count FROM music_playlists WHERE id = %s AND user_id = %s", (playlist_id, user_id))
+                playlist = cur.fetchone()
+                
+                if not playlist:
+                    return json_response(404, {'error': 'Playlist not found'}, event)
+                
+                # Страница читается по idx_playlist_tracks_playlist_position без сортировки всего плейлиста
+                keyset = ''
+                values = (playlist_id,)
+                if cursor:
+                    cursor_position, _, cursor_id = cursor.rpartition('_')
+                    keyset = 'AND (position, id) > (%s, %s)'
+                    values += (int(cursor_position), int(cursor_id))
+                
+                cur.execute(f"""
+                    SELECT track_id, track_name, artist, duration, position, added_at, id FROM playlist_tracks
+                    WHERE playlist_id = %s {keyset}
+                    ORDER BY position, id
+                    LIMIT %s
+                """, values + (limit + 1,))
+                rows = cur.fetchall()
+                
+                tracks = [track_to_dict(row) for row in rows[:limit]]
+                
+                next_cursor = None
+                if len(rows) > limit:
+                    next_cursor = f"{rows[limit - 1][4]}_{rows[limit - 1][6]}"
+                
+                if params.get('format') == 'columnar':
+                    tracks = columnar(tracks)
+                
+                return json_response(200, {
+                    'name': playlist[0],
+                    'track_count': playlist[1],
+                    'tracks': tracks,
+                    'next_cursor': next_cursor
+                }, event)
+        
+        elif method == 'POST':
+            body = json.loads(event.get('body', '{}'))
+            action = body.get('action')
+            
+            if action == 'create_playlist':
+                name = (body.get('name') or '').strip()
+                
+                if not name or len(name) > 100:
+                    return json_response(400, {'success': False, 'error': 'Invalid name'}, event)
+                
+                cur.execute(
+                    "INSERT INTO music_playlists (user_id, name) VALUES (%s, %s) RETURNING id, created_at",
+                    (user_id, name)
+                )
+                result = cur.fetchone()
+                conn.commit()
+                
+                return json_response(200, {'success': True, 'playlist_id': result[0], 'created_at': result[1].isoformat()}, event)
+            
+            elif action == 'rename_playlist':
+                playlist_id = body.get('playlist_id')
+                name = (body.get('name') or '').strip()
+                
+                if not name or len(name) > 100:
+                    return json_response(400, {'success': False, 'error': 'Invalid name'}, event)
+                
+                cur.execute("UPDATE music_playlists SET name = %s WHERE id = %s AND user_id = %s", (name, playlist_id, user_id))
+                renamed = cur.rowcount
+                conn.commit()
+                
+                if not renamed:
+                    return json_response(404, {'success': False, 'error': 'Playlist not found'}, event)
+                
+                return json_response(200, {'success': True}, event)
+            
+            elif action == 'add_tracks':
+                playlist_id = body.get('playlist_id')
+                tracks = body.get('tracks') or []
+                
+                if not tracks or len(tracks) > MAX_BULK_TRACKS or any(not track.get('track_id') or not track.get('track_name') for track in tracks):
+                    return json_response(400, {'success': False, 'error': f'From 1 to {MAX_BULK_TRACKS} tracks with track_id and track_name required'}, event)
+                
+                if not lock_playlist(cur, playlist_id, user_id):
+                    return json_response(404, {'success': False, 'error': 'Playlist not found'}, event)
+                
+                added = add_tracks(cur, playlist_id, tracks)
+                conn.commit()
+                
+                return json_response(200, {'success': True, 'added': added}, event)
+            
+            elif action == 'remove_tracks':
+                playlist_id = body.get('playlist_id')
+                track_ids = body.get('track_ids') or []
+                
+                if len(track_ids) > MAX_BULK_TRACKS:
+                    return json_response(400, {'success': False, 'error': f'At most {MAX_BULK_TRACKS} tracks per request'}, event)
+                
+                if not lock_playlist(cur, playlist_id, user_id):
+                    return json_response(404, {'success': False, 'error': 'Playlist not found'}, event)
+                
+                removed = remove_tracks(cur, playlist_id, track_ids)
+                conn.commit()
+                
+                return json_response(200, {'success': True, 'removed': removed}, event)
+            
+            elif action == 'move_tracks':
+                playlist_id = body.get('playlist_id')
+                # moves: [{track_id, after_track_id}], after_track_id = null ставит трек первым
+                moves = body.get('moves') or []
+                
+                if not moves or len(moves) > MAX_MOVES:
+                    return json_response(400, {'success': False, 'error': f'From 1 to {MAX_MOVES} moves per request'}, event)
+                
+                if not lock_playlist(cur, playlist_id, user_id):
+                    return json_response(404, {'success': False, 'error': 'Playlist not found'}, event)
+                
+                moved = 0
+                for move in moves:
+                    after_track_id = move.get('after_track_id')
+                    if move_track(cur, playlist_id, str(move.get('track_id')), str(after_track_id) if after_track_id is not None else None):
+                        moved += 1
+                conn.commit()
+                
+                return json_response(200, {'success': True, 'moved': moved}, event)
+        
+        elif method == 'DELETE':
+            params = event.get('queryStringParameters', {}) or {}
+            action = params.get('action')
+            
+            if action == 'delete_playlist':
+                playlist_id = params.get('playlist_id')
+                
+                if not lock_playlist(cur, playlist_id, user_id):
+                    return json_response(404, {'success': False, 'error': 'Playlist not found'}, event)
+                
+                cur.execute("DELETE FROM playlist_tracks WHERE playlist_id = %s", (playlist_id,))
+                cur.execute("DELETE FROM music_playlists WHERE id = %s", (playlist_id,))
+                conn.commit()
+                
+                return json_response(200, {'success': True}, event)
+        
+        return json_response(405, {'error': 'Method not allowed'}, event)
+    
+    finally:
+        cur.close()
+        conn.close()
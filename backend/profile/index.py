@@ -1,6 +1,7 @@
 import json
 import os
 import psycopg2
+from serialization import json_response
 
 def handler(event: dict, context) -> dict:
     """API для управления профилем пользователя"""
@@ -40,26 +41,22 @@ def handler(event: dict, context) -> dict:
                 
                 user = cur.fetchone()
                 if user:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({
-                            'id': user[0],
-                            'username': user[1],
-                            'display_name': user[2],
-                            'avatar_url': user[3],
-                            'banner_url': user[4],
-                            'bio': user[5],
-                            'status': user[6],
-                            'status_emoji': user[7],
-                            'is_online': user[8] and not user[9],
-                            'has_verification': user[10],
-                            'balance': float(user[11]) if user[11] else 0,
-                            'raccoon_coins': user[12],
-                            'created_at': user[13].isoformat() if user[13] else None,
-                            'last_seen': user[14].isoformat() if user[14] else None
-                        })
-                    }
+                    return json_response(200, {
+                        'id': user[0],
+                        'username': user[1],
+                        'display_name': user[2],
+                        'avatar_url': user[3],
+                        'banner_url': user[4],
+                        'bio': user[5],
+                        'status': user[6],
+                        'status_emoji': user[7],
+                        'is_online': user[8] and not user[9],
+                        'has_verification': user[10],
+                        'balance': float(user[11]) if user[11] else 0,
+                        'raccoon_coins': user[12],
+                        'created_at': user[13].isoformat() if user[13] else None,
+                        'last_seen': user[14].isoformat() if user[14] else None
+                    }, event)
             
             elif action == 'search_users':
                 query = params.get('query', '')
@@ -81,11 +78,7 @@ def handler(event: dict, context) -> dict:
                         'has_verification': row[4]
                     })
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'users': users})
-                }
+                return json_response(200, {'users': users}, event)
             
             elif action == 'get_friends':
                 cur.execute("""
@@ -105,11 +98,7 @@ def handler(event: dict, context) -> dict:
                         'is_online': row[4] and not row[5]
                     })
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'friends': friends})
-                }
+                return json_response(200, {'friends': friends}, event)
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
@@ -152,11 +141,7 @@ def handler(event: dict, context) -> dict:
                 )
                 conn.commit()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
-                }
+                return json_response(200, {'success': True}, event)
             
             elif action == 'add_friend':
                 friend_id = body.get('friend_id')
@@ -167,11 +152,7 @@ def handler(event: dict, context) -> dict:
                 )
                 conn.commit()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
-                }
+                return json_response(200, {'success': True}, event)
             
             elif action == 'accept_friend':
                 friend_id = body.get('friend_id')
@@ -182,11 +163,7 @@ def handler(event: dict, context) -> dict:
                 )
                 conn.commit()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
-                }
+                return json_response(200, {'success': True}, event)
             
             elif action == 'buy_verification':
                 cur.execute("SELECT balance FROM users WHERE id = %s", (user_id,))
@@ -199,23 +176,11 @@ def handler(event: dict, context) -> dict:
                     )
                     conn.commit()
                     
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True})
-                    }
+                    return json_response(200, {'success': True}, event)
                 else:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'Insufficient balance'})
-                    }
+                    return json_response(400, {'success': False, 'error': 'Insufficient balance'}, event)
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return json_response(405, {'error': 'Method not allowed'}, event)
     
     finally:
         cur.close()
@@ -1,6 +1,38 @@
 import json
 import os
 import psycopg2
+from serialization import json_response, columnar
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+GIFTS_PAGE_SIZE = 100
+GIFTS_MAX_PAGE_SIZE = 500
+MAX_GIFT_RECEIVERS = 10000
+
+def make_cursor(created_at, row_id):
+    """Курсор для keyset-пагинации по (created_at, id)"""
+    return f"{created_at.isoformat()}_{row_id}"
+
+def parse_cursor(cursor):
+    created_at, _, row_id = cursor.rpartition('_')
+    return created_at, int(row_id)
+
+def record_transaction(cur, from_user_id, to_user_id, amount, transaction_type, description=None):
+    """Записывает транзакцию и обновляет помесячные итоги отправителя и получателя одним запросом"""
+    cur.execute("""
+        WITH t AS (
+            INSERT INTO transactions (from_user_id, to_user_id, amount, transaction_type, description)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING from_user_id, to_user_id, amount, transaction_type, date_trunc('month', created_at)::date AS month
+        )
+        INSERT INTO transaction_monthly_totals (user_id, month, transaction_type, direction, total, tx_count)
+        SELECT from_user_id, month, transaction_type, 'out', amount, 1 FROM t WHERE from_user_id IS NOT NULL
+        UNION ALL
+        SELECT to_user_id, month, transaction_type, 'in', amount, 1 FROM t WHERE to_user_id IS NOT NULL
+        ON CONFLICT (user_id, month, transaction_type, direction) DO UPDATE
+        SET total = transaction_monthly_totals.total + EXCLUDED.total,
+            tx_count = transaction_monthly_totals.tx_count + EXCLUDED.tx_count
+    """, (from_user_id, to_user_id, amount, transaction_type, description))
 
 def handler(event: dict, context) -> dict:
     """API для магазина подарков и кошелька"""
@@ -47,24 +79,36 @@ def handler(event: dict, context) -> dict:
                         'category': row[4]
                     })
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'gifts': gifts})
-                }
+                return json_response(200, {'gifts': gifts}, event)
             
             elif action == 'my_gifts':
-                cur.execute("""
-                    SELECT ug.id, sg.name, sg.emoji, sg.price, u.username, ug.quantity, ug.received_at
-                    FROM user_gifts ug
+                limit = min(int(params.get('limit', GIFTS_PAGE_SIZE)), GIFTS_MAX_PAGE_SIZE)
+                cursor = params.get('cursor')
+                
+                keyset = ''
+                values = (user_id,)
+                if cursor:
+                    keyset = 'AND (ug.received_at, ug.id) < (%s, %s)'
+                    values += parse_cursor(cursor)
+                
+                # Инвентарь уже сгруппирован по (владелец, подарок, отправитель), страница читается по индексу
+                cur.execute(f"""
+                    SELECT ug.id, sg.name, sg.emoji, sg.price, u.username, ug.quantity, ug.received_at, ug.gift_id, ug.sender_id
+                    FROM (
+                        SELECT id, gift_id, sender_id, quantity, received_at
+                        FROM user_gifts ug
+                        WHERE ug.user_id = %s AND ug.quantity > 0 {keyset}
+                        ORDER BY ug.received_at DESC, ug.id DESC
+                        LIMIT %s
+                    ) ug
                     JOIN shop_gifts sg ON ug.gift_id = sg.id
                     LEFT JOIN users u ON ug.sender_id = u.id
-                    WHERE ug.user_id = %s
-                    ORDER BY ug.received_at DESC
-                """, (user_id,))
+                    ORDER BY ug.received_at DESC, ug.id DESC
+                """, values + (limit + 1,))
+                rows = cur.fetchall()
                 
                 my_gifts = []
-                for row in cur.fetchall():
+                for row in rows[:limit]:
                     my_gifts.append({
                         'id': row[0],
                         'name': row[1],
@@ -72,27 +116,103 @@ def handler(event: dict, context) -> dict:
                         'price': row[3],
                         'sender': row[4],
                         'quantity': row[5],
-                        'received_at': row[6].isoformat() if row[6] else None
+                        'received_at': row[6].isoformat() if row[6] else None,
+                        'gift_id': row[7],
+                        'sender_id': row[8]
                     })
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'gifts': my_gifts})
-                }
+                next_cursor = None
+                if len(rows) > limit:
+                    next_cursor = make_cursor(rows[limit - 1][6], rows[limit - 1][0])
+                
+                if params.get('format') == 'columnar':
+                    my_gifts = columnar(my_gifts)
+                
+                return json_response(200, {'gifts': my_gifts, 'next_cursor': next_cursor}, event)
             
             elif action == 'get_balance':
                 cur.execute("SELECT balance, raccoon_coins FROM users WHERE id = %s", (user_id,))
                 result = cur.fetchone()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'balance': float(result[0]) if result[0] else 0,
-                        'raccoon_coins': result[1]
+                return json_response(200, {
+                    'balance': float(result[0]) if result[0] else 0,
+                    'raccoon_coins': result[1]
+                }, event)
+            
+            elif action == 'transaction_history':
+                direction = params.get('direction', 'all')
+                limit = min(int(params.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+                cursor = params.get('cursor')
+                
+                keyset = ''
+                keyset_values = ()
+                if cursor:
+                    keyset = 'AND (created_at, id) < (%s, %s)'
+                    keyset_values = parse_cursor(cursor)
+                
+                columns = 'id, from_user_id, to_user_id, amount, transaction_type, description, created_at'
+                parts = []
+                values = []
+                if direction in ('all', 'out'):
+                    parts.append(f"(SELECT {columns} FROM transactions WHERE from_user_id = %s {keyset} ORDER BY created_at DESC, id DESC LIMIT %s)")
+                    values.extend((user_id,) + keyset_values + (limit + 1,))
+                if direction in ('all', 'in'):
+                    parts.append(f"(SELECT {columns} FROM transactions WHERE to_user_id = %s {keyset} ORDER BY created_at DESC, id DESC LIMIT %s)")
+                    values.extend((user_id,) + keyset_values + (limit + 1,))
+                
+                if not parts:
+                    return json_response(400, {'success': False, 'error': 'Invalid direction'}, event)
+                
+                cur.execute(f"""
+                    SELECT t.id, t.from_user_id, t.to_user_id, t.amount, t.transaction_type, t.description, t.created_at,
+                           u.username, u.display_name
+                    FROM ({' UNION '.join(parts)}) t
+                    LEFT JOIN users u ON u.id = CASE WHEN t.from_user_id = %s THEN t.to_user_id ELSE t.from_user_id END
+                    ORDER BY t.created_at DESC, t.id DESC
+                    LIMIT %s
+                """, tuple(values) + (user_id, limit + 1))
+                rows = cur.fetchall()
+                
+                transactions = []
+                for row in rows[:limit]:
+                    transactions.append({
+                        'id': row[0],
+                        'direction': 'out' if str(row[1]) == str(user_id) else 'in',
+                        'from_user_id': row[1],
+                        'to_user_id': row[2],
+                        'amount': float(row[3]),
+                        'transaction_type': row[4],
+                        'description': row[5],
+                        'created_at': row[6].isoformat() if row[6] else None,
+                        'counterparty_username': row[7],
+                        'counterparty_name': row[8]
                     })
-                }
+                
+                next_cursor = None
+                if len(rows) > limit:
+                    next_cursor = make_cursor(rows[limit - 1][6], rows[limit - 1][0])
+                
+                return json_response(200, {'transactions': transactions, 'next_cursor': next_cursor}, event)
+            
+            elif action == 'transaction_summary':
+                months = min(int(params.get('months', 12)), 120)
+                
+                cur.execute("""
+                    SELECT month, transaction_type, direction, total, tx_count
+                    FROM transaction_monthly_totals
+                    WHERE user_id = %s AND month > (date_trunc('month', CURRENT_TIMESTAMP) - make_interval(months => %s))::date
+                    ORDER BY month DESC, transaction_type, direction
+                """, (user_id, months))
+                
+                summary = {}
+                for row in cur.fetchall():
+                    month = row[0].isoformat()
+                    if month not in summary:
+                        summary[month] = {'month': month, 'incoming': {}, 'outgoing': {}}
+                    bucket = 'incoming' if row[2] == 'in' else 'outgoing'
+                    summary[month][bucket][row[1]] = {'total': float(row[3]), 'count': row[4]}
+                
+                return json_response(200, {'months': list(summary.values())}, event)
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
@@ -100,51 +220,69 @@ def handler(event: dict, context) -> dict:
             
             if action == 'buy_gift':
                 gift_id = body.get('gift_id')
+                quantity = int(body.get('quantity', 1))
                 
-                cur.execute("SELECT price FROM shop_gifts WHERE id = %s", (gift_id,))
-                price = cur.fetchone()[0]
-                
-                cur.execute("SELECT raccoon_coins FROM users WHERE id = %s", (user_id,))
-                raccoon_coins = cur.fetchone()[0]
+                if quantity < 1:
+                    return json_response(400, {'success': False, 'error': 'Invalid quantity'}, event)
                 
-                if raccoon_coins >= price:
-                    cur.execute(
-                        "UPDATE users SET raccoon_coins = raccoon_coins - %s WHERE id = %s",
-                        (price, user_id)
-                    )
-                    cur.execute(
-                        "INSERT INTO user_gifts (user_id, gift_id, sender_id) VALUES (%s, %s, %s)",
-                        (user_id, gift_id, user_id)
+                # Списание енотиков и пополнение инвентаря одним запросом
+                cur.execute("""
+                    WITH gift AS (
+                        SELECT id, price FROM shop_gifts WHERE id = %s AND is_active = TRUE
+                    ), paid AS (
+                        UPDATE users SET raccoon_coins = raccoon_coins - gift.price * %s
+                        FROM gift
+                        WHERE users.id = %s AND users.raccoon_coins >= gift.price * %s
+                        RETURNING users.id AS user_id, gift.id AS gift_id
                     )
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True})
-                    }
+                    INSERT INTO user_gifts (user_id, gift_id, sender_id, quantity)
+                    SELECT user_id, gift_id, user_id, %s FROM paid
+                    ON CONFLICT (user_id, gift_id, sender_id) DO UPDATE
+                    SET quantity = user_gifts.quantity + EXCLUDED.quantity, received_at = CURRENT_TIMESTAMP
+                    RETURNING id, quantity
+                """, (gift_id, quantity, user_id, quantity, quantity))
+                result = cur.fetchone()
+                conn.commit()
+                
+                if result:
+                    return json_response(200, {'success': True, 'user_gift_id': result[0], 'quantity': result[1]}, event)
                 else:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'Not enough raccoon coins'})
-                    }
+                    return json_response(400, {'success': False, 'error': 'Not enough raccoon coins'}, event)
             
             elif action == 'send_gift':
                 gift_user_gift_id = body.get('user_gift_id')
-                receiver_id = body.get('receiver_id')
+                quantity = int(body.get('quantity', 1))
+                receiver_ids = body.get('receiver_ids') or [body.get('receiver_id')]
+                receivers = [r for r in dict.fromkeys(int(r) for r in receiver_ids if r is not None) if str(r) != str(user_id)]
                 
-                cur.execute(
-                    "UPDATE user_gifts SET user_id = %s, sender_id = %s WHERE id = %s AND user_id = %s",
-                    (receiver_id, user_id, gift_user_gift_id, user_id)
-                )
+                if quantity < 1 or not receivers or len(receivers) > MAX_GIFT_RECEIVERS:
+                    return json_response(400, {'success': False, 'error': 'Invalid receivers or quantity'}, event)
+                
+                # Списываем quantity * receivers из строки инвентаря и раздаём всем получателям одним запросом
+                cur.execute("""
+                    WITH src AS (
+                        UPDATE user_gifts SET quantity = quantity - %s
+                        WHERE id = %s AND user_id = %s AND quantity >= %s
+                        RETURNING gift_id
+                    ), sent AS (
+                        INSERT INTO user_gifts (user_id, gift_id, sender_id, quantity)
+                        SELECT r.receiver_id, src.gift_id, %s, %s
+                        FROM src, unnest(%s::int[]) AS r(receiver_id)
+                        ON CONFLICT (user_id, gift_id, sender_id) DO UPDATE
+                        SET quantity = user_gifts.quantity + EXCLUDED.quantity, received_at = CURRENT_TIMESTAMP
+                        RETURNING 1
+                    )
+                    SELECT COUNT(*) FROM sent
+                """, (quantity * len(receivers), gift_user_gift_id, user_id, quantity * len(receivers),
+                      user_id, quantity, receivers))
+                sent_count = cur.fetchone()[0]
+                cur.execute("DELETE FROM user_gifts WHERE id = %s AND quantity = 0", (gift_user_gift_id,))
                 conn.commit()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
-                }
+                if sent_count:
+                    return json_response(200, {'success': True, 'sent': sent_count}, event)
+                else:
+                    return json_response(400, {'success': False, 'error': 'Not enough gifts'}, event)
             
             elif action == 'buy_raccoon_coins':
                 amount = body.get('amount')
@@ -160,17 +298,9 @@ def handler(event: dict, context) -> dict:
                     )
                     conn.commit()
                     
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True, 'received': amount + bonus})
-                    }
+                    return json_response(200, {'success': True, 'received': amount + bonus}, event)
                 else:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'Insufficient balance'})
-                    }
+                    return json_response(400, {'success': False, 'error': 'Insufficient balance'}, event)
             
             elif action == 'add_balance':
                 amount = body.get('amount')
@@ -181,11 +311,7 @@ def handler(event: dict, context) -> dict:
                 )
                 conn.commit()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
-                }
+                return json_response(200, {'success': True}, event)
             
             elif action == 'send_money':
                 receiver_id = body.get('receiver_id')
@@ -197,29 +323,14 @@ def handler(event: dict, context) -> dict:
                 if balance >= amount:
                     cur.execute("UPDATE users SET balance = balance - %s WHERE id = %s", (amount, user_id))
                     cur.execute("UPDATE users SET balance = balance + %s WHERE id = %s", (amount, receiver_id))
-                    cur.execute(
-                        "INSERT INTO transactions (from_user_id, to_user_id, amount, transaction_type) VALUES (%s, %s, %s, 'money')",
-                        (user_id, receiver_id, amount)
-                    )
+                    record_transaction(cur, user_id, receiver_id, amount, 'money')
                     conn.commit()
                     
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True})
-                    }
+                    return json_response(200, {'success': True}, event)
                 else:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'Insufficient balance'})
-                    }
+                    return json_response(400, {'success': False, 'error': 'Insufficient balance'}, event)
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return json_response(405, {'error': 'Method not allowed'}, event)
     
     finally:
         cur.close()
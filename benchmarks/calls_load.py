@@ -0,0 +1,74 @@
+"""Локальный нагрузочный тест установки звонков через handler функции calls
+
+Каждая пара пользователей параллельно проходит start_call -> accept_call -> end_call.
+Пользователи с id от --first-user-id до --first-user-id + 2 * --pairs - 1 должны существовать.
+
+Запуск: DATABASE_URL=... python benchmarks/calls_load.py --pairs 200 --rounds 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'calls'))
+
+from index import handler
+
+def call(method, user_id, payload):
+    event = {'httpMethod': method, 'headers': {'X-User-Id': str(user_id)}}
+    if method == 'POST':
+        event['body'] = json.dumps(payload)
+    else:
+        event['queryStringParameters'] = payload
+    started = time.perf_counter()
+    response = handler(event, None)
+    return response['statusCode'], json.loads(response['body']), time.perf_counter() - started
+
+def run_pair(caller_id, receiver_id, rounds):
+    timings = {'start_call': [], 'incoming_call': [], 'accept_call': [], 'end_call': []}
+    failures = 0
+    for _ in range(rounds):
+        status, body, elapsed = call('POST', caller_id, {'action': 'start_call', 'receiver_id': receiver_id})
+        timings['start_call'].append(elapsed)
+        if status != 200:
+            failures += 1
+            continue
+        call_id = body['call_id']
+        
+        _, _, elapsed = call('GET', receiver_id, {'action': 'incoming_call'})
+        timings['incoming_call'].append(elapsed)
+        
+        status, _, elapsed = call('POST', receiver_id, {'action': 'accept_call', 'call_id': call_id})
+        timings['accept_call'].append(elapsed)
+        failures += status != 200
+        
+        status, _, elapsed = call('POST', caller_id, {'action': 'end_call', 'call_id': call_id})
+        timings['end_call'].append(elapsed)
+        failures += status != 200
+    return timings, failures
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pairs', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--first-user-id', type=int, default=1)
+    args = parser.parse_args()
+    
+    pairs = [(args.first_user_id + 2 * i, args.first_user_id + 2 * i + 1) for i in range(args.pairs)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.pairs) as executor:
+        results = list(executor.map(lambda pair: run_pair(pair[0], pair[1], args.rounds), pairs))
+    total = time.perf_counter() - started
+    
+    print(f'{args.pairs} pairs x {args.rounds} rounds in {total:.2f} s, failures: {sum(f for _, f in results)}')
+    for step in ('start_call', 'incoming_call', 'accept_call', 'end_call'):
+        samples = sorted(t for timings, _ in results for t in timings[step])
+        if samples:
+            p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) > 1 else samples[0]
+            print(f'{step:<14} p50 {statistics.median(samples) * 1000:7.1f} ms  p95 {p95 * 1000:7.1f} ms  max {samples[-1] * 1000:7.1f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Накладные расходы проверки членства в функции chats
+
+Попадание в кэш меряется без базы; промах — это один индексный запрос get_member_role,
+его время меряется, только если задан DATABASE_URL.
+
+Запуск: python benchmarks/membership_cache.py --iterations 200000
+        DATABASE_URL=... python benchmarks/membership_cache.py --chat-id 1 --user-id 1
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'chats'))
+
+import index
+
+class RoleCursor:
+    """Отвечает на SELECT role из памяти, чтобы в замер попадал только путь через кэш"""
+    def execute(self, query, values=None):
+        pass
+    
+    def fetchone(self):
+        return ('member',)
+
+def per_call_us(func, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def bench_hits(iterations, chats):
+    cur = RoleCursor()
+    index._membership_cache.clear()
+    for chat_id in range(chats):
+        index.get_cached_member_role(cur, chat_id, 1)
+    return per_call_us(lambda i: index.get_cached_member_role(cur, i % chats, 1), iterations)
+
+def bench_misses(iterations):
+    cur = RoleCursor()
+    
+    def miss(i):
+        index.invalidate_membership(i, [1])
+        index.get_cached_member_role(cur, i, 1)
+    
+    index._membership_cache.clear()
+    return per_call_us(miss, iterations)
+
+def bench_database(chat_id, user_id, iterations):
+    conn = index.psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        index.get_member_role(cur, chat_id, user_id)
+        timings.append((time.perf_counter() - started) * 1e6)
+    conn.close()
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер проверки членства с кэшем и без')
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--chat-id', type=int, default=1)
+    parser.add_argument('--user-id', type=int, default=1)
+    parser.add_argument('--db-iterations', type=int, default=500)
+    args = parser.parse_args()
+    
+    print(f"cache hit:            {bench_hits(args.iterations, args.chats):8.2f} us")
+    print(f"cache miss (no I/O):  {bench_misses(args.iterations):8.2f} us")
+    
+    if os.environ.get('DATABASE_URL'):
+        timings = bench_database(args.chat_id, args.user_id, args.db_iterations)
+        print(f"get_member_role p50:  {statistics.median(timings):8.2f} us")
+        print(f"get_member_role p95:  {statistics.quantiles(timings, n=20)[18]:8.2f} us")
+
+if __name__ == '__main__':
+    main()
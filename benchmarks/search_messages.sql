@@ -0,0 +1,69 @@
+-- Бенчмарк search_messages на синтетических данных
+-- Запуск: psql "$DATABASE_URL" -v rows=10000000 -f benchmarks/search_messages.sql
+-- Все данные создаются во временной схеме bench и удаляются в конце, id задаются явно,
+-- чтобы не расходовать последовательности рабочих таблиц
+
+\if :{?rows}
+\else
+\set rows 1000000
+\endif
+\timing on
+
+DROP SCHEMA IF EXISTS bench CASCADE;
+CREATE SCHEMA bench;
+SET search_path = bench, public;
+
+CREATE TABLE bench.chat_members (LIKE public.chat_members INCLUDING DEFAULTS INCLUDING INDEXES);
+CREATE TABLE bench.messages (LIKE public.messages INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING INDEXES);
+
+-- 10 000 чатов, пользователь 1 состоит в каждом сотом
+INSERT INTO bench.chat_members (id, chat_id, user_id, role)
+SELECT chat_id, chat_id, 1, 'member' FROM generate_series(1, 10000, 100) AS chat_id;
+
+-- Сообщения из случайных слов словаря на двух языках
+INSERT INTO bench.messages (id, chat_id, sender_id, content, message_type, created_at)
+SELECT i,
+       1 + (i % 10000),
+       1 + (i % 1000),
+       (SELECT string_agg(w[1 + floor(random() * array_length(w, 1))::int], ' ')
+        FROM generate_series(1, 12), (SELECT ARRAY['привет', 'встреча', 'завтра', 'документы', 'отправил',
+              'проект', 'созвон', 'фотографии', 'hello', 'meeting', 'tomorrow', 'documents', 'project',
+              'release', 'деплой', 'тесты', 'музыка', 'подарок', 'енот', 'кофе'] AS w) dict
+        WHERE i > 0),
+       'text',
+       CURRENT_TIMESTAMP - (i || ' seconds')::interval
+FROM generate_series(1, :rows) AS i;
+
+ANALYZE bench.chat_members;
+ANALYZE bench.messages;
+
+-- Первая страница: редкое слово и частое слово
+EXPLAIN (ANALYZE, BUFFERS)
+WITH q AS (
+    SELECT websearch_to_tsquery('russian', 'документы проекта') || websearch_to_tsquery('english', 'документы проекта') AS query
+), hits AS (
+    SELECT m.id, m.chat_id, m.sender_id, m.content, m.created_at, ts_rank(m.search_vector, q.query) AS rank
+    FROM bench.messages m, q
+    WHERE m.search_vector @@ q.query
+      AND m.chat_id IN (SELECT chat_id FROM bench.chat_members WHERE user_id = 1 AND is_blocked = FALSE)
+)
+SELECT h.id, h.rank, ts_headline('russian', h.content, q.query, 'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5')
+FROM (SELECT * FROM hits ORDER BY rank DESC, id DESC LIMIT 21) h
+CROSS JOIN q
+ORDER BY h.rank DESC, h.id DESC;
+
+EXPLAIN (ANALYZE, BUFFERS)
+WITH q AS (
+    SELECT websearch_to_tsquery('russian', 'meetings') || websearch_to_tsquery('english', 'meetings') AS query
+), hits AS (
+    SELECT m.id, m.chat_id, m.sender_id, m.content, m.created_at, ts_rank(m.search_vector, q.query) AS rank
+    FROM bench.messages m, q
+    WHERE m.search_vector @@ q.query
+      AND m.chat_id IN (SELECT chat_id FROM bench.chat_members WHERE user_id = 1 AND is_blocked = FALSE)
+)
+SELECT h.id, h.rank, ts_headline('russian', h.content, q.query, 'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5')
+FROM (SELECT * FROM hits ORDER BY rank DESC, id DESC LIMIT 21) h
+CROSS JOIN q
+ORDER BY h.rank DESC, h.id DESC;
+
+DROP SCHEMA bench CASCADE;
@@ -0,0 +1,62 @@
+"""Микробенчмарк сериализации ответов: время кодирования и байты на проводе
+
+Запуск: python benchmarks/serialization.py [число сообщений]
+"""
+import gzip
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'chats'))
+
+import serialization
+from serialization import brotli, columnar, dumps, orjson
+
+def make_messages(count):
+    start = datetime(2026, 1, 1)
+    return [{
+        'id': i,
+        'sender_id': i % 50,
+        'sender_username': f'user{i % 50}',
+        'sender_name': f'Пользователь {i % 50}',
+        'sender_avatar': f'https://cdn.poehali.dev/avatars/{i % 50}.jpg',
+        'content': 'Привет! Встречаемся завтра в 10:00, не забудь документы по проекту.',
+        'message_type': 'text',
+        'file_url': None,
+        'duration': None,
+        'reply_to': None,
+        'is_read': True,
+        'is_edited': False,
+        'created_at': (start + timedelta(seconds=i)).isoformat(),
+        'reactions': [{'emoji': '❤️', 'count': i % 7}] if i % 3 == 0 else []
+    } for i in range(count)]
+
+def bench(label, encode, number=50):
+    body = encode()
+    seconds = timeit.timeit(encode, number=number) / number
+    print(f'{label:<28} {seconds * 1000:8.2f} ms {len(body):>10} B')
+    return body
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rows = {'messages': make_messages(count)}
+    cols = {'messages': columnar(rows['messages'])}
+    
+    print(f'{count} messages, orjson={"yes" if orjson else "no"}, brotli={"yes" if brotli else "no"}')
+    print(f'{"variant":<28} {"encode":>11} {"bytes":>12}')
+    bench('json.dumps (old handlers)', lambda: json.dumps(rows).encode())
+    bench('stdlib compact json', lambda: json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode())
+    if orjson:
+        bench('orjson', lambda: orjson.dumps(rows))
+    body = bench('dumps rows', lambda: dumps(rows))
+    columnar_body = bench('dumps columnar', lambda: dumps(cols))
+    
+    for name, payload in (('rows', body), ('columnar', columnar_body)):
+        bench(f'gzip {name}', lambda: gzip.compress(payload, compresslevel=serialization.GZIP_LEVEL))
+        if brotli:
+            bench(f'brotli {name}', lambda: brotli.compress(payload, quality=serialization.BROTLI_QUALITY))
+
+if __name__ == '__main__':
+    main()
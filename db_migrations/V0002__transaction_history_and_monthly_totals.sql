@@ -0,0 +1,29 @@
+-- Индексы для постраничной истории транзакций (keyset по created_at, id)
+CREATE INDEX IF NOT EXISTS idx_transactions_from_user_created ON transactions(from_user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_transactions_to_user_created ON transactions(to_user_id, created_at DESC, id DESC);
+
+-- Помесячные итоги входящих и исходящих транзакций пользователя
+CREATE TABLE IF NOT EXISTS transaction_monthly_totals (
+    user_id INTEGER REFERENCES users(id),
+    month DATE NOT NULL,
+    transaction_type VARCHAR(20) NOT NULL,
+    direction VARCHAR(3) NOT NULL CHECK (direction IN ('in', 'out')),
+    total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    tx_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month, transaction_type, direction)
+);
+
+-- Заполняем итоги по уже существующим транзакциям
+INSERT INTO transaction_monthly_totals (user_id, month, transaction_type, direction, total, tx_count)
+SELECT user_id, month, transaction_type, direction, SUM(amount), COUNT(*)
+FROM (
+    SELECT from_user_id AS user_id, date_trunc('month', created_at)::date AS month,
+           COALESCE(transaction_type, 'money') AS transaction_type, 'out' AS direction, amount
+    FROM transactions WHERE from_user_id IS NOT NULL
+    UNION ALL
+    SELECT to_user_id AS user_id, date_trunc('month', created_at)::date AS month,
+           COALESCE(transaction_type, 'money') AS transaction_type, 'in' AS direction, amount
+    FROM transactions WHERE to_user_id IS NOT NULL
+) t
+GROUP BY user_id, month, transaction_type, direction
+ON CONFLICT (user_id, month, transaction_type, direction) DO NOTHING;
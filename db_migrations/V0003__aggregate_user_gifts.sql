@@ -0,0 +1,22 @@
+-- Сворачиваем одинаковые подарки (владелец, подарок, отправитель) в одну строку с количеством
+UPDATE user_gifts ug
+SET quantity = agg.quantity, received_at = agg.received_at
+FROM (
+    SELECT MIN(id) AS keep_id, SUM(COALESCE(quantity, 1)) AS quantity, MAX(received_at) AS received_at
+    FROM user_gifts
+    GROUP BY user_id, gift_id, sender_id
+) agg
+WHERE ug.id = agg.keep_id;
+
+DELETE FROM user_gifts ug
+USING user_gifts keep
+WHERE ug.user_id = keep.user_id
+  AND ug.gift_id = keep.gift_id
+  AND ug.sender_id IS NOT DISTINCT FROM keep.sender_id
+  AND ug.id > keep.id;
+
+UPDATE user_gifts SET quantity = 1 WHERE quantity IS NULL;
+ALTER TABLE user_gifts ALTER COLUMN quantity SET NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_user_gifts_owner_gift_sender ON user_gifts(user_id, gift_id, sender_id);
+CREATE INDEX IF NOT EXISTS idx_user_gifts_user_received ON user_gifts(user_id, received_at DESC, id DESC);
@@ -0,0 +1,14 @@
+-- Платежи ЮKassa: одна строка на payment_id, зачисление на баланс ровно один раз
+CREATE TABLE IF NOT EXISTS payments (
+    payment_id VARCHAR(64) PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    amount DECIMAL(10, 2) NOT NULL,
+    currency VARCHAR(3) NOT NULL DEFAULT 'RUB',
+    status VARCHAR(30) NOT NULL DEFAULT 'pending',
+    credited_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_payments_user_id ON payments(user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_payments_unresolved ON payments(created_at) WHERE status IN ('pending', 'waiting_for_capture');
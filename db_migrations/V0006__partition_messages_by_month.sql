@@ -0,0 +1,72 @@
+-- Секционирование messages по месяцам created_at
+-- Внешние ключи на messages(id) невозможны для секционированной таблицы, поэтому снимаются
+ALTER TABLE message_reactions DROP CONSTRAINT IF EXISTS message_reactions_message_id_fkey;
+
+ALTER TABLE messages RENAME TO messages_legacy;
+ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey;
+DROP INDEX IF EXISTS idx_messages_chat_id;
+DROP INDEX IF EXISTS idx_messages_sender_id;
+DROP INDEX IF EXISTS idx_messages_search_vector;
+
+CREATE TABLE messages (
+    id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+    chat_id INTEGER REFERENCES chats(id),
+    sender_id INTEGER REFERENCES users(id),
+    reply_to INTEGER,
+    content TEXT,
+    message_type VARCHAR(20) NOT NULL CHECK (message_type IN ('text', 'voice', 'video', 'photo', 'sticker', 'gift', 'money', 'circle')),
+    file_url TEXT,
+    duration INTEGER,
+    is_read BOOLEAN DEFAULT FALSE,
+    is_edited BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    search_vector tsvector GENERATED ALWAYS AS (
+        to_tsvector('russian', COALESCE(content, '')) || to_tsvector('english', COALESCE(content, ''))
+    ) STORED,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Месячные секции от самого старого сообщения до года вперед
+DO $$
+DECLARE
+    month_start DATE := date_trunc('month', COALESCE((SELECT MIN(created_at) FROM messages_legacy), CURRENT_TIMESTAMP))::date;
+    last_month DATE := (date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '12 months')::date;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+            'messages_' || to_char(month_start, 'YYYY_MM'),
+            month_start,
+            (month_start + INTERVAL '1 month')::date
+        );
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+END $$;
+
+CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT;
+
+INSERT INTO messages (id, chat_id, sender_id, reply_to, content, message_type, file_url, duration, is_read, is_edited, created_at)
+SELECT id, chat_id, sender_id, reply_to, content, message_type, file_url, duration, is_read, is_edited, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM messages_legacy;
+
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+DROP TABLE messages_legacy;
+
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages(chat_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_sender_id ON messages(sender_id);
+CREATE INDEX IF NOT EXISTS idx_messages_id ON messages(id);
+CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages(chat_id, sender_id) WHERE is_read = FALSE;
+CREATE INDEX IF NOT EXISTS idx_messages_search_vector ON messages USING GIN (search_vector);
+
+-- Каталог секций, вынесенных в холодное хранилище
+CREATE TABLE IF NOT EXISTS message_archives (
+    partition_name VARCHAR(64) PRIMARY KEY,
+    range_start TIMESTAMP NOT NULL,
+    range_end TIMESTAMP NOT NULL,
+    location TEXT NOT NULL,
+    chat_ids INTEGER[] NOT NULL DEFAULT '{}',
+    row_count BIGINT NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'archived' CHECK (status IN ('archived', 'restored')),
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    restored_at TIMESTAMP
+);
@@ -0,0 +1,21 @@
+-- Очередь фоновой очистки сообщений: очистка чата и удаление всех сообщений пользователя
+CREATE TABLE IF NOT EXISTS purge_jobs (
+    id SERIAL PRIMARY KEY,
+    job_type VARCHAR(30) NOT NULL CHECK (job_type IN ('clear_chat', 'delete_account_messages')),
+    user_id INTEGER REFERENCES users(id),
+    chat_id INTEGER REFERENCES chats(id),
+    cutoff_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'failed')),
+    purged_messages BIGINT NOT NULL DEFAULT 0,
+    purged_reactions BIGINT NOT NULL DEFAULT 0,
+    purged_files BIGINT NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Активные задания служат надгробием: чтение скрывает попадающие под них сообщения до физического удаления
+CREATE INDEX IF NOT EXISTS idx_purge_jobs_active ON purge_jobs(user_id, chat_id) WHERE status IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS idx_purge_jobs_queue ON purge_jobs(id) WHERE status IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS idx_message_reactions_message_id ON message_reactions(message_id);
@@ -0,0 +1,19 @@
+-- Счетчик активных участников, чтобы не считать подписчиков больших каналов
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS member_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE chats c
+SET member_count = m.cnt
+FROM (
+    SELECT chat_id, COUNT(*) AS cnt FROM chat_members WHERE is_blocked = FALSE GROUP BY chat_id
+) m
+WHERE c.id = m.chat_id;
+
+-- Проверка членства читается только из индекса, заблокированные строки в него не попадают
+CREATE INDEX IF NOT EXISTS idx_chat_members_active_user_chat ON chat_members(user_id, chat_id) INCLUDE (role) WHERE is_blocked = FALSE;
+
+-- Постраничный список участников с фильтром по роли
+CREATE INDEX IF NOT EXISTS idx_chat_members_chat_role ON chat_members(chat_id, role, id) WHERE is_blocked = FALSE;
+CREATE INDEX IF NOT EXISTS idx_chat_members_chat_active ON chat_members(chat_id, id) WHERE is_blocked = FALSE;
+
+-- Покрывается уникальным индексом (chat_id, user_id)
+DROP INDEX IF EXISTS idx_chat_members_chat_id;
@@ -0,0 +1,23 @@
+-- Агрегированные счетчики реакций: чтение за O(число разных эмодзи)
+CREATE TABLE IF NOT EXISTS message_reaction_counts (
+    message_id INTEGER NOT NULL,
+    emoji VARCHAR(10) NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (message_id, emoji)
+);
+
+-- Буфер изменений: нажатия пишутся только сюда и периодически сворачиваются в счетчики
+CREATE TABLE IF NOT EXISTS reaction_count_deltas (
+    id BIGSERIAL PRIMARY KEY,
+    message_id INTEGER NOT NULL,
+    emoji VARCHAR(10) NOT NULL,
+    delta SMALLINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_reaction_count_deltas_message_id ON reaction_count_deltas(message_id);
+
+INSERT INTO message_reaction_counts (message_id, emoji, count)
+SELECT message_id, emoji, COUNT(*)
+FROM message_reactions
+GROUP BY message_id, emoji
+ON CONFLICT (message_id, emoji) DO NOTHING;
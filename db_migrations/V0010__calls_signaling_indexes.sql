@@ -0,0 +1,14 @@
+-- Сигнализация звонков и история
+ALTER TABLE calls ADD COLUMN IF NOT EXISTS answered_at TIMESTAMP;
+ALTER TABLE calls ADD COLUMN IF NOT EXISTS missed_seen BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- История звонков пользователя с keyset-пагинацией
+CREATE INDEX IF NOT EXISTS idx_calls_caller_started ON calls(caller_id, started_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_calls_receiver_started ON calls(receiver_id, started_at DESC, id DESC);
+
+-- Входящие и идущие звонки: крошечные частичные индексы для опроса
+CREATE INDEX IF NOT EXISTS idx_calls_receiver_live ON calls(receiver_id, started_at) WHERE status IN ('ringing', 'active');
+CREATE INDEX IF NOT EXISTS idx_calls_caller_live ON calls(caller_id) WHERE status IN ('ringing', 'active');
+
+-- Счетчик непросмотренных пропущенных читается из частичного индекса
+CREATE INDEX IF NOT EXISTS idx_calls_missed_unseen ON calls(receiver_id) WHERE status = 'missed' AND missed_seen = FALSE;
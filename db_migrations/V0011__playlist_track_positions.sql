@@ -0,0 +1,30 @@
+-- Порядок треков с промежутками: перенос трека меняет одну строку
+ALTER TABLE playlist_tracks ADD COLUMN IF NOT EXISTS position BIGINT;
+
+UPDATE playlist_tracks pt
+SET position = r.n * 65536
+FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY playlist_id ORDER BY added_at, id) AS n FROM playlist_tracks
+) r
+WHERE pt.id = r.id AND pt.position IS NULL;
+
+ALTER TABLE playlist_tracks ALTER COLUMN position SET NOT NULL;
+
+-- Счетчик треков, чтобы список плейлистов не считал большие импорты
+ALTER TABLE music_playlists ADD COLUMN IF NOT EXISTS track_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE music_playlists p
+SET track_count = t.cnt
+FROM (
+    SELECT playlist_id, COUNT(*) AS cnt FROM playlist_tracks GROUP BY playlist_id
+) t
+WHERE p.id = t.playlist_id;
+
+-- Страница треков по (position, id) и поиск хвоста плейлиста для добавления
+CREATE INDEX IF NOT EXISTS idx_playlist_tracks_playlist_position ON playlist_tracks(playlist_id, position, id);
+
+-- Удаление и перенос по track_id, проверка дублей при добавлении
+CREATE INDEX IF NOT EXISTS idx_playlist_tracks_playlist_track ON playlist_tracks(playlist_id, track_id);
+
+-- Плейлисты пользователя с keyset-пагинацией
+CREATE INDEX IF NOT EXISTS idx_music_playlists_user_created ON music_playlists(user_id, created_at DESC, id DESC);
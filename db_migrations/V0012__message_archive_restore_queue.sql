@@ -0,0 +1,17 @@
+-- Указатель на последнее сообщение: list_chats читает последнее сообщение из одной секции
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP;
+
+UPDATE chats c
+SET last_message_at = m.last_at
+FROM (
+    SELECT chat_id, MAX(created_at) AS last_at FROM messages GROUP BY chat_id
+) m
+WHERE c.id = m.chat_id;
+
+-- Очередь восстановления архивных секций: get_messages только ставит секцию в очередь
+ALTER TABLE message_archives DROP CONSTRAINT IF EXISTS message_archives_status_check;
+ALTER TABLE message_archives ADD CONSTRAINT message_archives_status_check CHECK (status IN ('archived', 'restoring', 'restored'));
+ALTER TABLE message_archives ADD COLUMN IF NOT EXISTS restore_requested_at TIMESTAMP;
+
+-- Поиск архива по чату через chat_ids @> ARRAY[chat_id] без перебора массивов
+CREATE INDEX IF NOT EXISTS idx_message_archives_chat_ids ON message_archives USING GIN (chat_ids);
@@ -0,0 +1,7 @@
+-- Повторы заданий очистки: сбойное задание ждет с растущей паузой и после нескольких попыток становится failed
+ALTER TABLE purge_jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE purge_jobs ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+-- Сорвавшееся задание продолжает скрывать свои сообщения при чтении
+DROP INDEX IF EXISTS idx_purge_jobs_active;
+CREATE INDEX IF NOT EXISTS idx_purge_jobs_active ON purge_jobs(user_id, chat_id) WHERE status IN ('pending', 'running', 'failed');
@@ -0,0 +1,2 @@
+-- Сигнал живости идущего звонка: без него звонок завершается, и участники не остаются "заняты"
+ALTER TABLE calls ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP;
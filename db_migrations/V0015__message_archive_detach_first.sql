@@ -0,0 +1,3 @@
+-- Выгрузка в архив сначала отсоединяет секцию: archiving отмечает отсоединенную, но еще не выгруженную таблицу
+ALTER TABLE message_archives DROP CONSTRAINT IF EXISTS message_archives_status_check;
+ALTER TABLE message_archives ADD CONSTRAINT message_archives_status_check CHECK (status IN ('archiving', 'archived', 'restoring', 'restored'));
@@ -0,0 +1,122 @@
+"""Интеграционные тесты архива сообщений функции chats: выгрузка, очистка и восстановление секции
+
+Нужна база с примененными db_migrations: DATABASE_URL=... python -m unittest discover tests
+"""
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import uuid
+from datetime import date
+
+CHATS_DIR = os.path.join(os.path.dirname(__file__), '..', 'backend', 'chats')
+# В конец пути: модуль index других функций не должен подменяться модулем chats
+sys.path.append(CHATS_DIR)
+
+PARTITION = 'messages_2001_01'
+
+def load_chats():
+    spec = importlib.util.spec_from_file_location('chats_index', os.path.join(CHATS_DIR, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@unittest.skipUnless(os.environ.get('DATABASE_URL'), 'DATABASE_URL is not set')
+class ArchiveRestoreTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import psycopg2
+        cls.index = load_chats()
+        cls.conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+    
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        os.environ['MESSAGES_ARCHIVE_DIR'] = self.archive_dir
+        self.user_ids = []
+        with self.conn.cursor() as cur:
+            for name in ('author', 'reader'):
+                tag = uuid.uuid4().hex[:12]
+                cur.execute(
+                    "INSERT INTO users (phone, username, display_name, password_hash) VALUES (%s, %s, %s, 'x') RETURNING id",
+                    (tag, f'{name}_{tag}', 'Archive test')
+                )
+                self.user_ids.append(cur.fetchone()[0])
+            self.author_id, self.reader_id = self.user_ids
+            cur.execute("INSERT INTO chats (type, created_by) VALUES ('private', %s) RETURNING id", (self.author_id,))
+            self.chat_id = cur.fetchone()[0]
+            cur.execute(
+                "INSERT INTO chat_members (chat_id, user_id) SELECT %s, unnest(%s::int[])",
+                (self.chat_id, self.user_ids)
+            )
+            self.index.create_partition(cur, date(2001, 1, 1))
+            cur.execute("""
+                INSERT INTO messages (chat_id, sender_id, content, message_type, created_at)
+                VALUES (%s, %s, 'old author message', 'text', '2001-01-15'), (%s, %s, 'old reader message', 'text', '2001-01-16')
+                RETURNING id
+            """, (self.chat_id, self.author_id, self.chat_id, self.reader_id))
+            self.author_message_id = cur.fetchone()[0]
+            cur.execute(
+                "INSERT INTO message_reactions (message_id, user_id, emoji) VALUES (%s, %s, '👍')",
+                (self.author_message_id, self.reader_id)
+            )
+        self.conn.commit()
+    
+    def tearDown(self):
+        self.conn.rollback()
+        with self.conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {PARTITION}")
+            cur.execute("DELETE FROM message_archives WHERE partition_name = %s", (PARTITION,))
+            cur.execute("DELETE FROM message_reactions WHERE user_id = ANY(%s)", (self.user_ids,))
+            cur.execute("DELETE FROM purge_jobs WHERE user_id = ANY(%s)", (self.user_ids,))
+            cur.execute("DELETE FROM messages WHERE chat_id = %s", (self.chat_id,))
+            cur.execute("DELETE FROM chat_members WHERE chat_id = %s", (self.chat_id,))
+            cur.execute("DELETE FROM chats WHERE id = %s", (self.chat_id,))
+            cur.execute("DELETE FROM users WHERE id = ANY(%s)", (self.user_ids,))
+        self.conn.commit()
+        os.environ.pop('MESSAGES_ARCHIVE_DIR', None)
+        shutil.rmtree(self.archive_dir, ignore_errors=True)
+    
+    def chat_messages(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT content FROM messages WHERE chat_id = %s ORDER BY created_at", (self.chat_id,))
+            contents = [row[0] for row in cur.fetchall()]
+        self.conn.commit()
+        return contents
+    
+    def test_restore_keeps_messages_without_purge(self):
+        self.assertEqual(self.index.archive_partition(self.conn, None, PARTITION)['rows'], 2)
+        self.assertEqual(self.chat_messages(), [])
+        
+        self.assertTrue(self.index.restore_partition(self.conn, None, PARTITION))
+        
+        self.assertEqual(self.chat_messages(), ['old author message', 'old reader message'])
+    
+    def test_restore_after_finished_clear_drops_purged_messages(self):
+        self.index.archive_partition(self.conn, None, PARTITION)
+        with self.conn.cursor() as cur:
+            job_id = self.index.enqueue_purge(cur, 'clear_chat', self.author_id, self.chat_id)
+        self.conn.commit()
+        
+        # Воркер не видит выгруженную секцию: задание завершается, ничего не удалив
+        self.index.run_purge_jobs(self.conn, None, pause=0, max_seconds=5)
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT status, purged_messages FROM purge_jobs WHERE id = %s", (job_id,))
+            self.assertEqual(cur.fetchone(), ('done', 0))
+        self.conn.commit()
+        
+        self.assertTrue(self.index.restore_partition(self.conn, None, PARTITION))
+        
+        self.assertEqual(self.chat_messages(), ['old reader message'])
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM message_reactions WHERE message_id = %s", (self.author_message_id,))
+            self.assertEqual(cur.fetchone()[0], 0)
+        self.conn.commit()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+"""Интеграционные тесты функции payments против заглушки API ЮKassa
+
+Нужна база с примененными db_migrations: DATABASE_URL=... python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import unittest
+import uuid
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'payments'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from yookassa_mock import YooKassaMock
+
+@unittest.skipUnless(os.environ.get('DATABASE_URL'), 'DATABASE_URL is not set')
+class PaymentsTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import psycopg2
+        import index
+        cls.index = index
+        cls.mock = YooKassaMock().__enter__()
+        os.environ.update({
+            'YOOKASSA_API_URL': cls.mock.url,
+            'YOOKASSA_SHOP_ID': '100500',
+            'YOOKASSA_SECRET_KEY': 'test_secret'
+        })
+        index.configure_yookassa()
+        cls.conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        cls.mock.__exit__(None, None, None)
+    
+    def setUp(self):
+        tag = uuid.uuid4().hex[:12]
+        self.payment_ids = []
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO users (phone, username, display_name, password_hash) VALUES (%s, %s, %s, 'x') RETURNING id",
+                (tag, f'pay_{tag}', 'Payments test')
+            )
+            self.user_id = cur.fetchone()[0]
+        self.conn.commit()
+    
+    def tearDown(self):
+        with self.conn.cursor() as cur:
+            cur.execute("DELETE FROM payments WHERE payment_id = ANY(%s)", (self.payment_ids,))
+            cur.execute("DELETE FROM users WHERE id = %s", (self.user_id,))
+        self.conn.commit()
+    
+    def add_local_payment(self, amount, status='pending', age_minutes=60):
+        payment_id = f'test-{uuid.uuid4()}'
+        self.payment_ids.append(payment_id)
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO payments (payment_id, user_id, amount, status, created_at)
+                VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP - make_interval(mins => %s))
+            """, (payment_id, self.user_id, amount, status, age_minutes))
+        self.conn.commit()
+        return payment_id
+    
+    def balance(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT balance FROM users WHERE id = %s", (self.user_id,))
+            balance = cur.fetchone()[0]
+        self.conn.commit()
+        return balance
+    
+    def local_payment(self, payment_id):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT status, credited_at FROM payments WHERE payment_id = %s", (payment_id,))
+            row = cur.fetchone()
+        self.conn.commit()
+        return row
+
+class NotificationTest(PaymentsTestCase):
+    def notify(self, payment_id):
+        response = self.index.handler({
+            'httpMethod': 'POST',
+            'body': json.dumps({'type': 'notification', 'event': 'payment.succeeded', 'object': {'id': payment_id}})
+        }, None)
+        return response['statusCode']
+    
+    def test_unknown_payment_is_ignored_without_provider_call(self):
+        payment_id = f'forged-{uuid.uuid4()}'
+        self.payment_ids.append(payment_id)
+        self.mock.add_payment(payment_id, 'succeeded', '1000.00', user_id=self.user_id)
+        
+        self.assertEqual(self.notify(payment_id), 200)
+        self.assertEqual(self.mock.requests[payment_id], 0)
+        self.assertIsNone(self.local_payment(payment_id))
+        self.assertEqual(self.balance(), Decimal('0'))
+    
+    def test_succeeded_payment_is_credited_once(self):
+        payment_id = self.add_local_payment('150.00', age_minutes=0)
+        self.mock.add_payment(payment_id, 'succeeded', '150.00', user_id=self.user_id)
+        
+        self.assertEqual(self.notify(payment_id), 200)
+        self.assertEqual(self.notify(payment_id), 200)
+        
+        self.assertEqual(self.balance(), Decimal('150.00'))
+        self.assertEqual(self.local_payment(payment_id)[0], 'succeeded')
+        # Повторное уведомление по завершенному платежу отвечается из локальной таблицы
+        self.assertEqual(self.mock.requests[payment_id], 1)
+    
+    def test_provider_error_is_not_a_server_error(self):
+        payment_id = self.add_local_payment('80.00', age_minutes=0)
+        self.mock.add_payment(payment_id, 'succeeded', '80.00', user_id=self.user_id, error_status=500)
+        
+        self.assertEqual(self.notify(payment_id), 502)
+        self.assertEqual(self.local_payment(payment_id), ('pending', None))
+        self.assertEqual(self.balance(), Decimal('0'))
+
+class ReconcileTest(PaymentsTestCase):
+    def reconcile(self, **kwargs):
+        return self.index.reconcile_payments(self.conn, **kwargs)
+    
+    def test_credits_once_and_rerun_is_idempotent(self):
+        payment_id = self.add_local_payment('200.00')
+        self.mock.add_payment(payment_id, 'succeeded', '200.00', user_id=self.user_id)
+        
+        report = self.reconcile()
+        self.assertGreaterEqual(report['credited'], 1)
+        self.assertEqual(self.balance(), Decimal('200.00'))
+        self.assertIsNotNone(self.local_payment(payment_id)[1])
+        
+        self.reconcile()
+        self.assertEqual(self.balance(), Decimal('200.00'))
+        # Завершенный платеж больше не попадает в выборку и не запрашивается
+        self.assertEqual(self.mock.requests[payment_id], 1)
+    
+    def test_webhook_credit_is_not_repeated(self):
+        payment_id = self.add_local_payment('50.00')
+        self.mock.add_payment(payment_id, 'succeeded', '50.00', user_id=self.user_id)
+        
+        with self.conn.cursor() as cur:
+            self.index.apply_payment_status(cur, self.index.Payment.find_one(payment_id))
+        self.conn.commit()
+        self.reconcile()
+        
+        self.assertEqual(self.balance(), Decimal('50.00'))
+    
+    def test_timeout_leaves_payment_pending(self):
+        payment_id = self.add_local_payment('30.00')
+        self.mock.add_payment(payment_id, 'succeeded', '30.00', user_id=self.user_id, delay=2)
+        
+        report = self.reconcile(timeout=0.3)
+        
+        self.assertGreaterEqual(report['timeouts'], 1)
+        self.assertEqual(self.local_payment(payment_id), ('pending', None))
+        self.assertEqual(self.balance(), Decimal('0'))
+    
+    def test_provider_error_is_counted(self):
+        payment_id = self.add_local_payment('40.00')
+        self.mock.add_payment(payment_id, 'succeeded', '40.00', user_id=self.user_id, error_status=500)
+        
+        report = self.reconcile()
+        
+        self.assertGreaterEqual(report['errors'], 1)
+        self.assertEqual(self.local_payment(payment_id), ('pending', None))
+    
+    def test_amount_drift_is_reported(self):
+        payment_id = self.add_local_payment('100.00')
+        self.mock.add_payment(payment_id, 'canceled', '90.00', user_id=self.user_id)
+        
+        report = self.reconcile()
+        
+        drift = [item for item in report['drift'] if item['payment_id'] == payment_id]
+        self.assertEqual(drift, [{
+            'payment_id': payment_id,
+            'reason': 'amount_mismatch',
+            'local_amount': 100.0,
+            'provider_amount': 90.0
+        }])
+        self.assertEqual(self.local_payment(payment_id), ('canceled', None))
+    
+    def test_young_payments_are_skipped(self):
+        payment_id = self.add_local_payment('10.00', age_minutes=0)
+        self.mock.add_payment(payment_id, 'succeeded', '10.00', user_id=self.user_id)
+        
+        self.reconcile()
+        
+        self.assertEqual(self.mock.requests[payment_id], 0)
+
+if __name__ == '__main__':
+    unittest.main()
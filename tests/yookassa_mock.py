@@ -0,0 +1,89 @@
+"""Локальная заглушка API ЮKassa для тестов функции payments
+
+Отдает GET /v3/payments/<id> из словаря payments. Для платежа можно задать задержку ответа
+(проверка таймаутов) или HTTP-код ошибки; счетчик requests показывает, сколько раз SDK ходил за платежом.
+
+    with YooKassaMock() as mock:
+        mock.add_payment('pay-1', 'succeeded', '100.00', user_id=1)
+        os.environ['YOOKASSA_API_URL'] = mock.url
+"""
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class YooKassaMock:
+    def __init__(self):
+        self.payments = {}
+        self.requests = Counter()
+        mock = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                prefix = '/v3/payments/'
+                payment_id = self.path[len(prefix):] if self.path.startswith(prefix) else None
+                mock.requests[payment_id] += 1
+                payment = mock.payments.get(payment_id)
+                
+                if payment is None:
+                    self.respond(404, {'type': 'error', 'code': 'not_found', 'description': 'Payment not found'})
+                    return
+                if payment['delay']:
+                    time.sleep(payment['delay'])
+                if payment['error_status']:
+                    self.respond(payment['error_status'], {'type': 'error', 'code': 'internal_error', 'description': 'Mock error'})
+                    return
+                
+                self.respond(200, {
+                    'id': payment_id,
+                    'status': payment['status'],
+                    'paid': payment['status'] == 'succeeded',
+                    'amount': {'value': payment['amount'], 'currency': 'RUB'},
+                    'created_at': '2026-01-01T00:00:00.000Z',
+                    'description': 'Пополнение баланса Speakly',
+                    'metadata': {'user_id': str(payment['user_id'])} if payment['user_id'] else {},
+                    'recipient': {'account_id': '100500', 'gateway_id': '100700'},
+                    'refundable': False,
+                    'test': True
+                })
+            
+            def respond(self, status, payload):
+                body = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент уже ушел по таймауту
+                    pass
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_port}/v3'
+    
+    def add_payment(self, payment_id, status, amount, user_id=None, delay=0, error_status=None):
+        self.payments[payment_id] = {
+            'status': status,
+            'amount': str(amount),
+            'user_id': user_id,
+            'delay': delay,
+            'error_status': error_status
+        }
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()